@@ -0,0 +1,436 @@
+import io
+import struct
+import wave
+import zlib
+
+import numpy as np
+
+# 靜音切割設定
+SILENCE_FRAME_MS = 30            # 計算能量的音框長度
+SILENCE_THRESHOLD_DB = -40.0     # 相對於最大音框能量，低於此值視為靜音
+SILENCE_FLOOR_DB = -60.0         # 絕對能量（dBFS）低於此值的音框一律視為靜音，避免整段雜訊被當成語音
+MIN_SILENCE_MS = 300             # 至少連續這麼長的靜音才可作為切割點
+FORCED_SPLIT_OVERLAP_SECONDS = 1.5  # 找不到靜音而強制切割時，前後段重疊的長度
+
+# 轉錄前處理設定
+TARGET_SAMPLE_RATE = 16000       # 語音辨識只需要 16 kHz
+MAX_PAUSE_MS = 600               # 超過此長度的靜音會被壓縮
+KEEP_PAUSE_MS = 400              # 壓縮後保留的靜音長度，保留句子間的停頓（需不小於 MIN_SILENCE_MS 才能作為切割點）
+
+
+class AudioDecodeError(ValueError):
+    """
+    WAV 無法解碼（例如 IEEE float 或 WAVE_FORMAT_EXTENSIBLE 等 wave 模組不支援的格式）
+    """
+
+
+def is_wav(data: bytes) -> bool:
+    return len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def decode_wav(data: bytes) -> tuple[np.ndarray, int]:
+    """
+    解碼 PCM WAV
+
+    參數:
+    - data: WAV 檔案內容
+
+    返回:
+    - (samples, sample_rate)，samples 為 float32、形狀 (frames, channels)、範圍 [-1, 1]
+
+    無法解碼時拋出 AudioDecodeError
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav_file:
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            sample_rate = wav_file.getframerate()
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise AudioDecodeError(f"無法解碼 WAV: {e}") from e
+
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / (1 << 23)
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise AudioDecodeError(f"不支援的 WAV 取樣寬度: {sample_width} bytes")
+
+    return samples.reshape(-1, channels), sample_rate
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """
+    將 float32 樣本編碼為 16-bit PCM WAV
+
+    參數:
+    - samples: 形狀 (frames,) 或 (frames, channels)，範圍 [-1, 1]
+    - sample_rate: 取樣率
+
+    返回:
+    - WAV 檔案內容
+    """
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=1)
+
+
+def frame_energy_db(mono: np.ndarray, sample_rate: int, frame_ms: int = SILENCE_FRAME_MS) -> np.ndarray:
+    """
+    計算每個音框的 RMS 能量（dBFS）
+    """
+    frame_length = max(1, sample_rate * frame_ms // 1000)
+    frame_count = len(mono) // frame_length
+    if frame_count == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    frames = mono[:frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1)) + 1e-10
+    return (20 * np.log10(rms)).astype(np.float32)
+
+
+def silence_mask(mono: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    標記靜音音框：比最大音框低 SILENCE_THRESHOLD_DB 以上，或絕對能量低於 SILENCE_FLOOR_DB
+    """
+    energy = frame_energy_db(mono, sample_rate)
+    if len(energy) == 0:
+        return np.zeros(0, dtype=bool)
+    return (energy < energy.max() + SILENCE_THRESHOLD_DB) | (energy < SILENCE_FLOOR_DB)
+
+
+def silent_frames(mono: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    標記屬於足夠長靜音區段的音框
+    """
+    silent = silence_mask(mono, sample_rate)
+
+    min_frames = max(1, MIN_SILENCE_MS // SILENCE_FRAME_MS)
+    result = np.zeros_like(silent)
+    run_start = None
+    for index, value in enumerate(np.append(silent, False)):
+        if value and run_start is None:
+            run_start = index
+        elif not value and run_start is not None:
+            if index - run_start >= min_frames:
+                result[run_start:index] = True
+            run_start = None
+    return result
+
+
+def plan_segments(mono: np.ndarray, sample_rate: int, target_seconds: float, max_seconds: float) -> list[tuple[int, int, bool]]:
+    """
+    規劃切割點：每段盡量在 target_seconds 附近的靜音處切開，最長不超過 max_seconds。
+    找不到靜音時在 max_seconds 處強制切割，並讓下一段往前重疊一小段避免切斷字詞。
+
+    返回:
+    - [(start_sample, end_sample, overlaps_previous)]
+    """
+    total = len(mono)
+    frame_length = max(1, sample_rate * SILENCE_FRAME_MS // 1000)
+    silent = silent_frames(mono, sample_rate)
+
+    segments = []
+    start = 0
+    overlaps_previous = False
+    while start < total:
+        if total - start <= max_seconds * sample_rate:
+            segments.append((start, total, overlaps_previous))
+            break
+
+        # 在 [start + target/2, start + max] 範圍內找最接近 target 的靜音音框中點
+        window_start = (start + int(target_seconds * sample_rate / 2)) // frame_length
+        window_end = min((start + int(max_seconds * sample_rate)) // frame_length, len(silent))
+        target_frame = (start + int(target_seconds * sample_rate)) // frame_length
+
+        candidates = np.nonzero(silent[window_start:window_end])[0] + window_start
+        if len(candidates):
+            best = candidates[np.argmin(np.abs(candidates - target_frame))]
+            end = int(best * frame_length + frame_length // 2)
+            segments.append((start, end, overlaps_previous))
+            start = end
+            overlaps_previous = False
+        else:
+            end = start + int(max_seconds * sample_rate)
+            segments.append((start, end, overlaps_previous))
+            start = end - int(FORCED_SPLIT_OVERLAP_SECONDS * sample_rate)
+            overlaps_previous = True
+
+    return segments
+
+
+def merge_overlapping_texts(texts: list[str], overlaps: list[bool], min_overlap_chars: int = 2) -> str:
+    """
+    依序接合各段轉錄文字。與前一段有重疊的段落，移除開頭與前一段結尾重複的文字。
+    """
+    merged = ""
+    for text, overlaps_previous in zip(texts, overlaps):
+        text = text.strip()
+        if not text:
+            continue
+        if merged and overlaps_previous:
+            longest = 0
+            for size in range(min(len(merged), len(text), 80), min_overlap_chars - 1, -1):
+                if merged.endswith(text[:size]):
+                    longest = size
+                    break
+            text = text[longest:].lstrip()
+        if merged and text:
+            # 中文之間不加空白，其他語言以空白分隔
+            if merged[-1].isascii() and text[0].isascii():
+                merged += " "
+        merged += text
+    return merged
+
+
+def _box_filter(signal: np.ndarray, width: int) -> np.ndarray:
+    # 以累積和計算移動平均，O(N)
+    if width <= 1:
+        return signal
+    padded = np.concatenate([np.full(width // 2, signal[0]), signal, np.full(width - width // 2 - 1, signal[-1])])
+    cumsum = np.cumsum(padded, dtype=np.float64)
+    cumsum = np.concatenate([[0.0], cumsum])
+    return ((cumsum[width:] - cumsum[:-width]) / width).astype(np.float32)
+
+
+def resample(mono: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """
+    重新取樣。降頻時先以兩次移動平均（三角形濾波器）抑制混疊，再線性內插。
+    """
+    if source_rate == target_rate or len(mono) == 0:
+        return mono.astype(np.float32)
+
+    if target_rate < source_rate:
+        width = int(round(source_rate / target_rate))
+        mono = _box_filter(_box_filter(mono, width), width)
+
+    duration = len(mono) / source_rate
+    target_length = int(round(duration * target_rate))
+    source_positions = np.arange(target_length, dtype=np.float64) * (source_rate / target_rate)
+    return np.interp(source_positions, np.arange(len(mono)), mono).astype(np.float32)
+
+
+def compact_silence(mono: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    以能量式 VAD 去除開頭與結尾的靜音，並把中間過長的靜音壓縮到 KEEP_PAUSE_MS
+    """
+    frame_length = max(1, sample_rate * SILENCE_FRAME_MS // 1000)
+    voiced = ~silence_mask(mono, sample_rate)
+    if len(voiced) == 0:
+        return mono
+    if not voiced.any():
+        return mono[:0]
+
+    max_pause = max(1, MAX_PAUSE_MS // SILENCE_FRAME_MS)
+    keep_pause = max(1, KEEP_PAUSE_MS // SILENCE_FRAME_MS)
+    first = int(np.argmax(voiced))
+    last = len(voiced) - int(np.argmax(voiced[::-1]))
+
+    # 標記要保留的音框
+    keep = np.zeros(len(voiced), dtype=bool)
+    keep[first:last] = True
+    run_start = None
+    for index in range(first, last + 1):
+        is_voiced = index < last and voiced[index]
+        if not is_voiced and run_start is None:
+            run_start = index
+        elif is_voiced and run_start is not None:
+            if index - run_start > max_pause:
+                # 保留靜音前後各一半，讓停頓聽起來自然
+                head = keep_pause // 2
+                keep[run_start + head:index - (keep_pause - head)] = False
+            run_start = None
+
+    sample_keep = np.repeat(keep, frame_length)
+    tail = mono[len(sample_keep):] if last == len(voiced) else mono[:0]
+    return np.concatenate([mono[:len(sample_keep)][sample_keep], tail])
+
+
+def preprocess_for_transcription(data: bytes) -> tuple[bytes, dict]:
+    """
+    轉錄前處理：解碼 WAV、轉單聲道、降到 16 kHz、壓縮靜音，再編碼為 16-bit WAV
+
+    參數:
+    - data: 原始 WAV 檔案內容
+
+    返回:
+    - (處理後的 WAV 內容, 統計資訊)
+
+    無法解碼時拋出 AudioDecodeError
+    """
+    samples, sample_rate = decode_wav(data)
+    mono = resample(to_mono(samples), sample_rate, TARGET_SAMPLE_RATE)
+    compacted = compact_silence(mono, TARGET_SAMPLE_RATE)
+    processed = encode_wav(compacted, TARGET_SAMPLE_RATE)
+
+    stats = {
+        "original_bytes": len(data),
+        "processed_bytes": len(processed),
+        "bytes_saved": len(data) - len(processed),
+        "original_seconds": round(len(samples) / sample_rate, 2),
+        "processed_seconds": round(len(compacted) / TARGET_SAMPLE_RATE, 2),
+        "original_sample_rate": sample_rate,
+        "original_channels": samples.shape[1],
+    }
+    return processed, stats
+
+
+# 儲存用的精簡音訊格式
+# 標頭: magic(4s) version(B) codec(B) channels(B) sample_width(B) sample_rate(I) frames(Q) order(B)，其後為 zlib 壓縮的資料
+COMPACT_MAGIC = b"SWDA"
+COMPACT_VERSION = 1
+COMPACT_HEADER = struct.Struct("<4sBBBBIQB")
+COMPACT_CONTENT_TYPE = "application/x-swda"
+CODEC_LOSSLESS = 1   # 固定預測殘差 + 位元組平面重排 + zlib，可完整還原
+CODEC_MULAW = 2      # 單聲道 16 kHz、8-bit μ-law + zlib，語音用的有損格式
+CODEC_NAMES = {"lossless": CODEC_LOSSLESS, "speech": CODEC_MULAW}
+
+
+def is_compact(data: bytes) -> bool:
+    return data[:4] == COMPACT_MAGIC
+
+
+def _read_pcm_ints(data: bytes) -> tuple[np.ndarray, int, int]:
+    # 讀取 WAV 為整數樣本 (frames, channels)，保留原始精度
+    with wave.open(io.BytesIO(data), "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    if sample_width == 1:
+        ints = np.frombuffer(frames, dtype=np.uint8).astype(np.int32) - 128
+    elif sample_width == 2:
+        ints = np.frombuffer(frames, dtype="<i2").astype(np.int32)
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+    else:
+        raise ValueError(f"精簡格式不支援 {sample_width} bytes 的取樣寬度")
+
+    return ints.reshape(-1, channels), sample_rate, sample_width
+
+
+def _write_pcm_ints(ints: np.ndarray, sample_rate: int, sample_width: int) -> bytes:
+    if sample_width == 1:
+        frames = (ints + 128).astype(np.uint8).tobytes()
+    elif sample_width == 2:
+        frames = ints.astype("<i2").tobytes()
+    else:
+        values = ints.astype("<i4").reshape(-1)
+        frames = values.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(ints.shape[1])
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(frames)
+    return buffer.getvalue()
+
+
+def _residual(ints: np.ndarray, order: int) -> np.ndarray:
+    residual = ints
+    for _ in range(order):
+        residual = np.diff(residual, axis=0, prepend=0)
+    return residual
+
+
+def _shuffle_bytes(values: np.ndarray) -> bytes:
+    # 把每個 int32 的同一個位元組放在一起，殘差的高位元組幾乎都是 0 或 0xFF，壓縮效果較好
+    return values.astype("<i4").reshape(-1).view(np.uint8).reshape(-1, 4).T.tobytes()
+
+
+def _unshuffle_bytes(data: bytes, count: int) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint8).reshape(4, count).T.copy().view("<i4").reshape(-1).astype(np.int64)
+
+
+def _mulaw_encode(mono: np.ndarray) -> np.ndarray:
+    magnitude = np.log1p(255 * np.abs(np.clip(mono, -1.0, 1.0))) / np.log(256)
+    return np.round((np.sign(mono) * magnitude + 1) / 2 * 255).astype(np.uint8)
+
+
+def _mulaw_decode(codes: np.ndarray) -> np.ndarray:
+    signal = codes.astype(np.float32) / 255 * 2 - 1
+    return (np.sign(signal) * (np.power(256.0, np.abs(signal)) - 1) / 255).astype(np.float32)
+
+
+def encode_compact(data: bytes, codec: str) -> tuple[bytes, dict]:
+    """
+    將 WAV 轉換為儲存用的精簡格式
+
+    參數:
+    - data: WAV 檔案內容
+    - codec: "lossless"（可完整還原）或 "speech"（單聲道 16 kHz μ-law）
+
+    返回:
+    - (精簡格式內容, 原始音訊參數)
+    """
+    codec_id = CODEC_NAMES[codec]
+    ints, sample_rate, sample_width = _read_pcm_ints(data)
+    frames, channels = ints.shape
+    original = {
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "sample_width": sample_width,
+        "frames": frames,
+        "bytes": len(data),
+    }
+
+    if codec_id == CODEC_LOSSLESS:
+        # 一階與二階固定預測中選擇殘差較小的
+        candidates = [_residual(ints, order) for order in (1, 2)]
+        order = 1 + int(np.abs(candidates[1]).sum() < np.abs(candidates[0]).sum())
+        payload = zlib.compress(_shuffle_bytes(candidates[order - 1]), 6)
+        header = COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, codec_id, channels, sample_width, sample_rate, frames, order)
+    else:
+        scale = float(1 << (8 * sample_width - 1))
+        mono = resample(ints.mean(axis=1).astype(np.float32) / scale, sample_rate, TARGET_SAMPLE_RATE)
+        payload = zlib.compress(_mulaw_encode(mono).tobytes(), 6)
+        header = COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, codec_id, 1, 1, TARGET_SAMPLE_RATE, len(mono), 0)
+
+    return header + payload, original
+
+
+def decode_compact(data: bytes) -> bytes:
+    """
+    將精簡格式還原為 WAV
+    """
+    magic, version, codec_id, channels, sample_width, sample_rate, frames, order = COMPACT_HEADER.unpack_from(data)
+    if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+        raise ValueError("無法辨識的精簡音訊格式")
+    payload = zlib.decompress(data[COMPACT_HEADER.size:])
+
+    if codec_id == CODEC_LOSSLESS:
+        ints = _unshuffle_bytes(payload, frames * channels).reshape(frames, channels)
+        for _ in range(order):
+            ints = np.cumsum(ints, axis=0)
+        return _write_pcm_ints(ints, sample_rate, sample_width)
+
+    if codec_id == CODEC_MULAW:
+        mono = _mulaw_decode(np.frombuffer(payload, dtype=np.uint8))
+        return encode_wav(mono, sample_rate)
+
+    raise ValueError(f"未知的精簡音訊編碼: {codec_id}")
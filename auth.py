@@ -0,0 +1,250 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+from fastapi import HTTPException, Request, status
+
+import db
+import logs
+
+logger = logs.get_logger(__name__)
+
+# Token 設定，可用環境變數調整
+AUTH_SECRET = os.getenv("AUTH_SECRET")                                                  # HMAC 簽章金鑰，多個 worker 需設定相同的值
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "900"))            # access token 有效時間
+REFRESH_TOKEN_TTL_SECONDS = int(os.getenv("REFRESH_TOKEN_TTL_SECONDS", str(30 * 24 * 3600)))  # refresh token 有效時間
+AUTH_USER_CACHE_TTL_SECONDS = int(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "300"))      # 使用者資料快取時間
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "0") == "1"                                  # 1 時所有非公開的 API 都需要 access token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")                                                   # 管理功能（效能分析等）使用的金鑰，未設定時停用
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+# 不需要 token 的路徑
+PUBLIC_PATHS = {"/api/login", "/api/register", "/api/token/refresh", "/docs", "/redoc", "/openapi.json", "/metrics", "/healthz", "/readyz"}
+
+if not AUTH_SECRET:
+    AUTH_SECRET = secrets.token_urlsafe(32)
+    logger.warning("未設定 AUTH_SECRET，使用隨機金鑰，重新啟動後所有 token 都會失效")
+
+_SECRET = AUTH_SECRET.encode("utf-8")
+_HEADER = base64.urlsafe_b64encode(json.dumps({"alg": "HS256", "typ": "JWT"}).encode()).rstrip(b"=")
+
+_revoked = {}      # jti -> exp，已撤銷且尚未過期的 token
+_user_cache = {}   # username -> (快取到期時間, 使用者資料)
+_lock = threading.Lock()
+
+
+class InvalidTokenError(Exception):
+    """
+    Token 格式錯誤、簽章不符、過期或已撤銷
+    """
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(signing_input: bytes) -> bytes:
+    return _b64encode(hmac.new(_SECRET, signing_input, hashlib.sha256).digest())
+
+
+def create_token(username: str, token_type: str, token_version: int = 0) -> tuple[str, dict]:
+    """
+    產生 HS256 簽章的 JWT
+
+    參數:
+    - username: 使用者名稱
+    - token_type: ACCESS 或 REFRESH
+    - token_version: 使用者的 token 版本，遞增後先前發出的 token 全部失效
+
+    返回:
+    - (token, claims)
+    """
+    now = int(time.time())
+    ttl = ACCESS_TOKEN_TTL_SECONDS if token_type == ACCESS else REFRESH_TOKEN_TTL_SECONDS
+    claims = {
+        "sub": username,
+        "typ": token_type,
+        "ver": token_version,
+        "iat": now,
+        "exp": now + ttl,
+        "jti": secrets.token_urlsafe(12),
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    signing_input = _HEADER + b"." + payload
+    return (signing_input + b"." + _sign(signing_input)).decode("ascii"), claims
+
+
+def issue_token_pair(username: str, token_version: int = 0) -> dict:
+    """
+    產生 access token 與 refresh token 的登入回應
+    """
+    access_token, _ = create_token(username, ACCESS, token_version)
+    refresh_token, _ = create_token(username, REFRESH, token_version)
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL_SECONDS,
+    }
+
+
+def decode_token(token: str, token_type: str = ACCESS) -> dict:
+    """
+    驗證簽章、過期時間與撤銷狀態，不查詢資料庫
+
+    返回:
+    - claims
+    """
+    try:
+        header, payload, signature = token.encode("ascii").split(b".")
+    except (UnicodeEncodeError, ValueError):
+        raise InvalidTokenError("token 格式錯誤")
+
+    if header != _HEADER or not hmac.compare_digest(signature, _sign(header + b"." + payload)):
+        raise InvalidTokenError("token 簽章不符")
+
+    try:
+        claims = json.loads(_b64decode(payload.decode("ascii")))
+    except ValueError:
+        raise InvalidTokenError("token 格式錯誤")
+
+    if claims.get("typ") != token_type:
+        raise InvalidTokenError("token 類型不符")
+    if claims.get("exp", 0) < time.time():
+        raise InvalidTokenError("token 已過期")
+    if claims.get("jti") in _revoked:
+        raise InvalidTokenError("token 已撤銷")
+
+    return claims
+
+
+def revoke(claims: dict):
+    """
+    撤銷 token，直到它原本的過期時間為止
+    """
+    now = time.time()
+    with _lock:
+        _revoked[claims["jti"]] = claims["exp"]
+        # 順便清除已過期的撤銷紀錄，避免無限成長
+        for jti in [jti for jti, exp in _revoked.items() if exp < now]:
+            del _revoked[jti]
+
+
+async def get_user(client, username: str) -> dict | None:
+    """
+    取得使用者的 token 相關資料，優先使用記憶體快取
+
+    返回:
+    - {"username", "token_version"}，使用者不存在時返回 None
+    """
+    entry = _user_cache.get(username)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    user = await db.get_auth_user(client, username)
+    info = None if user is None else {"username": username, "token_version": user.get("token_version", 0)}
+    with _lock:
+        _user_cache[username] = (time.monotonic() + AUTH_USER_CACHE_TTL_SECONDS, info)
+    return info
+
+
+def invalidate_user(username: str):
+    """
+    使用者資料變更（例如登出所有裝置）後清除快取
+    """
+    with _lock:
+        _user_cache.pop(username, None)
+
+
+async def verify_request_token(client, token: str, token_type: str = ACCESS) -> dict:
+    """
+    驗證 token 並確認使用者仍存在、token 版本未被作廢
+    """
+    claims = decode_token(token, token_type)
+    user = await get_user(client, claims["sub"])
+    if user is None or user["token_version"] != claims.get("ver", 0):
+        raise InvalidTokenError("token 已失效")
+    return claims
+
+
+def _bearer_token(request: Request) -> str | None:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token.strip()
+
+
+def check_user(request: Request, user_id: str):
+    """
+    確認請求的 token 屬於 user_id。沒有帶 token 且未強制驗證時不檢查。
+    """
+    claims = getattr(request.state, "auth", None)
+    if claims is not None and claims["sub"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="無權存取其他使用者的資料")
+
+
+async def authenticate(request: Request):
+    """
+    全域的驗證 dependency：驗證 Authorization header 的 access token，
+    並確認路徑、查詢參數或表單中的 user_id 與 token 的使用者相同。
+    MongoDB 客戶端取自 app.state.database。
+    """
+    request.state.auth = None
+    if request.url.path in PUBLIC_PATHS:
+        return
+
+    token = _bearer_token(request)
+    if token is None:
+        if AUTH_REQUIRED:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="需要登入",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        return
+
+    try:
+        request.state.auth = await verify_request_token(request.app.state.database, token)
+    except InvalidTokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    user_id = request.path_params.get("user_id") or request.query_params.get("user_id")
+    if user_id is None and request.headers.get("content-type", "").startswith(
+        ("multipart/form-data", "application/x-www-form-urlencoded")
+    ):
+        # FastAPI 在解析 dependency 前已讀取表單，這裡取得的是快取的結果
+        user_id = (await request.form()).get("user_id")
+    if user_id is not None:
+        check_user(request, user_id)
+
+
+
+def is_admin_token(value: str | None) -> bool:
+    """
+    確認是否為管理金鑰，未設定 ADMIN_TOKEN 時一律為 False
+    """
+    return bool(ADMIN_TOKEN) and value is not None and hmac.compare_digest(value.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+
+async def require_admin(request: Request):
+    """
+    管理端點的 dependency：需要帶 X-Admin-Token header
+    """
+    if not is_admin_token(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="需要管理權限")
@@ -0,0 +1,350 @@
+"""
+儲存層熱點路徑的離線基準測試
+
+對本機 mongod（或 mongomock 記憶體替身）產生合成的使用者與筆記資料，測量
+save_diary_entry、get_content_from_note_id、fuzzy_search、get_sorted_note_list
+的延遲分位數、吞吐量、峰值 RSS 與每次呼叫的 MongoDB 指令數，結果寫成 JSON 供跨 commit 比較。
+
+    python benchmark.py --notes 50 --lines 40 --audio-kb 64 --output bench.json
+    python benchmark.py --backend mongomock --compare bench.json
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+import uuid
+
+# 基準測試預設只輸出警告，避免日誌影響測量結果
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import db
+import dbtrace
+import logs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+OPERATIONS = ("save_diary_entry", "get_content_from_note_id", "fuzzy_search", "get_sorted_note_list")
+
+# 合成文字使用的詞彙，搜尋時從中挑選關鍵字
+VOCABULARY = (
+    "今天", "早餐", "散步", "會議", "咖啡", "下雨", "朋友", "電影", "晚餐", "讀書",
+    "morning", "project", "deadline", "coffee", "walk", "music", "train", "garden", "dinner", "sleep",
+)
+
+
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 為單位，macOS 以 byte 為單位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def connect(backend: str, uri: str):
+    """
+    建立測試用的客戶端。mongod 會註冊指令追蹤以計算每次呼叫的指令數，mongomock 不支援指令事件。
+    """
+    if backend == "mongomock":
+        try:
+            import mongomock
+            import mongomock.gridfs
+        except ImportError:
+            raise SystemExit("使用 --backend mongomock 需要先安裝 mongomock")
+        mongomock.gridfs.enable_gridfs_integration()
+        return mongomock.MongoClient(), False
+
+    import pymongo
+
+    client = pymongo.MongoClient(uri, event_listeners=[dbtrace.TraceListener()], serverSelectionTimeoutMS=5000)
+    client.admin.command("ping")
+    return client, True
+
+
+class DataGenerator:
+    """
+    依設定產生固定亂數種子的文字、音訊與圖片內容
+    """
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self._audio = self._make_audio(args.audio_kb) if args.audio_kb > 0 else None
+        self._image = self._make_image(args.image_kb) if args.image_kb > 0 else None
+
+    def text(self) -> str:
+        words = []
+        length = 0
+        while length < self.args.text_length:
+            word = self.random.choice(VOCABULARY)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:self.args.text_length]
+
+    def query(self) -> str:
+        return self.random.choice(VOCABULARY)
+
+    def _make_audio(self, size_kb: int) -> bytes:
+        import numpy as np
+
+        import audio
+
+        # 16 kHz 單聲道 16-bit PCM，每秒約 32 KB
+        sample_rate = 16000
+        frames = max(1, size_kb * 1024 // 2)
+        rng = np.random.default_rng(self.args.seed)
+        t = np.arange(frames) / sample_rate
+        samples = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(frames)
+        return audio.encode_wav(samples.astype(np.float32).reshape(-1, 1), sample_rate)
+
+    def _make_image(self, size_kb: int) -> bytes:
+        import numpy as np
+        from PIL import Image
+
+        # 雜訊圖片幾乎無法壓縮，以像素數控制 JPEG 大小
+        side = max(16, int((size_kb * 1024 / 1.5) ** 0.5))
+        rng = np.random.default_rng(self.args.seed)
+        pixels = rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    def entry(self, line_id: int) -> dict:
+        """
+        save_diary_entry 的參數，依 --audio-ratio / --image-ratio 決定行的類型
+        """
+        roll = self.random.random()
+        audio_ratio = self.args.audio_ratio if self._audio is not None else 0
+        if roll < audio_ratio:
+            return {
+                "entry_type": "audio",
+                "audio_file": types.SimpleNamespace(filename=f"line_{line_id}.wav", content_type="audio/wav"),
+                "audio_content": self._audio,
+            }
+        if self._image is not None and roll < audio_ratio + self.args.image_ratio:
+            return {
+                "entry_type": "image",
+                "image_file": types.SimpleNamespace(filename=f"line_{line_id}.jpg", content_type="image/jpeg"),
+                "image_content": self._image,
+            }
+        return {"entry_type": "text", "text": self.text()}
+
+
+async def populate(client, generator: DataGenerator, args) -> dict[str, list[str]]:
+    """
+    產生合成的使用者與筆記
+
+    返回:
+    - {user_id: [note_id, ...]}
+    """
+    run_id = uuid.uuid4().hex[:8]
+    users = {}
+    for user_index in range(args.users):
+        user_id = f"bench_{run_id}_{user_index}"
+        note_ids = []
+        for note_index in range(args.notes):
+            note_id = f"note_{note_index:05d}"
+            for line_id in range(args.lines):
+                await db.save_diary_entry(client, user_id, note_id, line_id, **generator.entry(line_id))
+            await db.add_note_id_to_note_list(client, user_id, note_id)
+            note_ids.append(note_id)
+        users[user_id] = note_ids
+    return users
+
+
+async def _measure(name: str, iterations: int, warmup: int, call, trace_commands: bool) -> dict:
+    latencies = []
+    commands = []
+    rss_before = _peak_rss_mb()
+
+    for _ in range(warmup):
+        await call()
+
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        token = dbtrace.start_trace() if trace_commands else None
+        call_started_at = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - call_started_at) * 1000)
+        if token is not None:
+            commands.append(len(dbtrace.stop_trace(token).commands))
+    elapsed = time.perf_counter() - started_at
+
+    result = {
+        "iterations": iterations,
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "min_ms": round(min(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p90_ms": round(_percentile(latencies, 90), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "throughput_per_s": round(iterations / elapsed, 2) if elapsed > 0 else None,
+        "commands_per_call": round(statistics.fmean(commands), 2) if commands else None,
+        # ru_maxrss 只會增加，這裡記錄的是此操作結束時整個程序的峰值
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_growth_mb": round(_peak_rss_mb() - rss_before, 1) if rss_before is not None else None,
+    }
+    print(
+        f"{name:<26} p50={result['p50_ms']:>9.2f}ms p99={result['p99_ms']:>9.2f}ms "
+        f"{result['throughput_per_s'] or 0:>8.1f}/s commands={result['commands_per_call']}",
+        file=sys.stderr
+    )
+    return result
+
+
+async def run(args) -> dict:
+    client, trace_commands = connect(args.backend, args.mongo_uri)
+    generator = DataGenerator(args)
+
+    populate_started_at = time.perf_counter()
+    users = await populate(client, generator, args)
+    populate_seconds = time.perf_counter() - populate_started_at
+
+    user_ids = list(users)
+    picker = random.Random(args.seed + 1)
+    next_line = {user_id: args.lines for user_id in user_ids}
+
+    async def save_diary_entry():
+        user_id = picker.choice(user_ids)
+        line_id = next_line[user_id]
+        next_line[user_id] += 1
+        await db.save_diary_entry(client, user_id, "note_bench_writes", line_id, **generator.entry(line_id))
+
+    async def get_content_from_note_id():
+        user_id = picker.choice(user_ids)
+        await db.get_content_from_note_id(client, user_id, picker.choice(users[user_id]))
+
+    async def fuzzy_search():
+        user_id = picker.choice(user_ids)
+        await db.fuzzy_search(client, user_id, users[user_id], generator.query())
+
+    async def get_sorted_note_list():
+        await db.get_sorted_note_list(client, picker.choice(user_ids))
+
+    calls = {
+        "save_diary_entry": save_diary_entry,
+        "get_content_from_note_id": get_content_from_note_id,
+        "fuzzy_search": fuzzy_search,
+        "get_sorted_note_list": get_sorted_note_list,
+    }
+
+    results = {}
+    try:
+        for name in args.operations:
+            results[name] = await _measure(name, args.iterations, args.warmup, calls[name], trace_commands)
+    finally:
+        if not args.keep:
+            for user_id in user_ids:
+                client.drop_database(user_id)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "audio_storage_codec": db.AUDIO_STORAGE_CODEC,
+            "populate_seconds": round(populate_seconds, 2),
+            "config": {
+                key: getattr(args, key)
+                for key in ("users", "notes", "lines", "text_length", "audio_kb", "image_kb",
+                            "audio_ratio", "image_ratio", "iterations", "warmup", "seed")
+            },
+        },
+        "operations": results,
+    }
+
+
+def compare(current: dict, baseline: dict):
+    """
+    與先前的結果比較 p50 / p99 與指令數，變化以百分比表示
+    """
+    print(f"\n與 {baseline['meta'].get('commit')} 比較:", file=sys.stderr)
+    for name, result in current["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if previous is None:
+            continue
+        parts = []
+        for key in ("p50_ms", "p99_ms", "commands_per_call"):
+            if result.get(key) is None or not previous.get(key):
+                continue
+            change = (result[key] - previous[key]) / previous[key] * 100
+            parts.append(f"{key}={previous[key]}→{result[key]} ({change:+.1f}%)")
+        print(f"{name:<26} {' '.join(parts)}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="儲存層熱點路徑的離線基準測試")
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--users", type=int, default=2, help="合成使用者數")
+    parser.add_argument("--notes", type=int, default=20, help="每個使用者的筆記數")
+    parser.add_argument("--lines", type=int, default=30, help="每篇筆記的行數")
+    parser.add_argument("--text-length", type=int, default=200, help="每行文字的字元數")
+    parser.add_argument("--audio-kb", type=int, default=0, help="語音行的 WAV 大小，0 表示不產生語音")
+    parser.add_argument("--image-kb", type=int, default=0, help="圖片行的 JPEG 大小，0 表示不產生圖片")
+    parser.add_argument("--audio-ratio", type=float, default=0.2, help="語音行的比例")
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="圖片行的比例")
+    parser.add_argument("--iterations", type=int, default=50, help="每個操作的測量次數")
+    parser.add_argument("--warmup", type=int, default=5, help="測量前的暖身次數")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="要測量的操作，以逗號分隔")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_output.json", help="結果 JSON 的路徑，- 表示輸出到 stdout")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    parser.add_argument("--keep", action="store_true", help="結束後保留合成資料")
+    args = parser.parse_args(argv)
+
+    args.operations = [name.strip() for name in args.operations.split(",") if name.strip()]
+    unknown = set(args.operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"未知的操作: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logs.setup_logging()
+    result = asyncio.run(run(args))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"結果已寫入 {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
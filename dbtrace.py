@@ -0,0 +1,230 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from pymongo import monitoring
+
+import logs
+import metrics
+
+logger = logs.get_logger(__name__)
+
+# 開發與測試環境用的 MongoDB 指令追蹤，可用環境變數調整
+DB_TRACE_ENABLED = os.getenv("DB_TRACE_ENABLED", "0") == "1"
+DB_TRACE_MAX_COMMANDS = int(os.getenv("DB_TRACE_MAX_COMMANDS", "25"))        # 單一請求超過此指令數即標記
+DB_TRACE_REPEAT_THRESHOLD = int(os.getenv("DB_TRACE_REPEAT_THRESHOLD", "5"))  # 相同查詢形狀重複超過此次數即標記為 N+1
+DB_TRACE_HEADER = "X-DB-Trace"
+
+# 最近被標記的請求，供管理端點查看
+_flagged = deque(maxlen=int(os.getenv("DB_TRACE_KEEP_FLAGGED", "100")))
+
+_current = contextvars.ContextVar("db_trace", default=None)
+
+# 各指令中查詢條件所在的欄位
+_FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+_WRITE_FIELDS = {
+    "update": ("updates", "q"),
+    "delete": ("deletes", "q"),
+}
+
+
+def filter_shape(value):
+    """
+    將查詢條件轉為只保留欄位與運算子的形狀，值以 ? 取代
+    """
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        # $or / $and 等運算子保留每個條件的形狀，$in 的值只保留一個 ?
+        if value and all(isinstance(item, dict) for item in value):
+            return [filter_shape(item) for item in value]
+        return ["?"]
+    return "?"
+
+
+def command_filter(command_name: str, command: dict):
+    if command_name in _FILTER_FIELDS:
+        return command.get(_FILTER_FIELDS[command_name])
+    if command_name in _WRITE_FIELDS:
+        field, key = _WRITE_FIELDS[command_name]
+        statements = command.get(field) or []
+        return statements[0].get(key) if statements else None
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        return pipeline[0].get("$match") if pipeline and "$match" in pipeline[0] else None
+    return None
+
+
+def _documents_returned(command_name: str, reply: dict) -> int | None:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        return len(batch) if batch is not None else None
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") is not None else 0
+    if "n" in reply:
+        return reply["n"]
+    return None
+
+
+class RequestTrace:
+    """
+    單一請求發出的 MongoDB 指令紀錄
+    """
+    def __init__(self):
+        self.commands = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        query = command_filter(event.command_name, event.command)
+        entry = {
+            "command": event.command_name,
+            "collection": collection if isinstance(collection, str) else None,
+            "collection_kind": metrics.collection_kind(collection),
+            "shape": json.dumps(filter_shape(query), sort_keys=True) if query is not None else None,
+        }
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = entry
+
+    def finished(self, event, reply: dict | None):
+        with self._lock:
+            entry = self._pending.pop((event.connection_id, event.request_id), None)
+            if entry is None:
+                return
+            entry["duration_ms"] = round(event.duration_micros / 1000, 2)
+            entry["documents"] = _documents_returned(event.command_name, reply) if reply is not None else None
+            entry["failed"] = reply is None
+            self.commands.append(entry)
+
+    def summary(self) -> dict:
+        """
+        統計指令數、總時間與重複的查詢形狀，並判斷是否需要標記
+        """
+        with self._lock:
+            commands = list(self.commands)
+
+        # 查詢形狀以集合類型區分，同一形狀對不同筆記集合的查詢也算重複
+        repeats = Counter(
+            (entry["command"], entry["collection_kind"], entry["shape"])
+            for entry in commands
+            if entry["shape"] is not None
+        )
+        repeated = [
+            {"command": command, "collection_kind": kind, "shape": shape, "count": count}
+            for (command, kind, shape), count in repeats.most_common()
+            if count > DB_TRACE_REPEAT_THRESHOLD
+        ]
+
+        reasons = []
+        if len(commands) > DB_TRACE_MAX_COMMANDS:
+            reasons.append("too_many_commands")
+        if repeated:
+            reasons.append("repeated_query")
+
+        return {
+            "commands": len(commands),
+            "total_ms": round(sum(entry["duration_ms"] for entry in commands), 2),
+            "documents": sum(entry["documents"] or 0 for entry in commands),
+            "max_repeat": repeats.most_common(1)[0][1] if repeats else 0,
+            "repeated": repeated,
+            "flagged": reasons,
+        }
+
+
+class TraceListener(monitoring.CommandListener):
+    """
+    將指令記錄到目前請求的 RequestTrace。背景工作等沒有追蹤中的請求時不做任何事。
+    asyncio.to_thread 會帶入呼叫端的 context，執行緒中發出的指令也會被記錄。
+    """
+    def started(self, event):
+        trace = _current.get()
+        if trace is not None:
+            trace.started(event)
+
+    def succeeded(self, event):
+        trace = _current.get()
+        if trace is not None:
+            trace.finished(event, event.reply)
+
+    def failed(self, event):
+        trace = _current.get()
+        if trace is not None:
+            trace.finished(event, None)
+
+
+def start_trace():
+    """
+    開始追蹤目前請求，返回用於結束追蹤的 token
+    """
+    return _current.set(RequestTrace())
+
+
+def stop_trace(token) -> RequestTrace:
+    """
+    結束追蹤並返回紀錄，不做任何標記（供基準測試等非請求的情境使用）
+    """
+    trace = _current.get()
+    _current.reset(token)
+    return trace
+
+
+def finish_trace(token, method: str, path: str, route: str | None) -> dict:
+    """
+    結束追蹤並返回摘要，被標記的請求會記錄警告並保留詳細的指令列表
+    """
+    trace = stop_trace(token)
+    summary = trace.summary()
+
+    if summary["flagged"]:
+        logger.warning(
+            "請求的資料庫指令過多",
+            method=method,
+            route=route or path,
+            commands=summary["commands"],
+            total_ms=summary["total_ms"],
+            max_repeat=summary["max_repeat"],
+            flagged=summary["flagged"]
+        )
+        _flagged.append({
+            "at": time.time(),
+            "request_id": logs.request_id_var.get(),
+            "method": method,
+            "path": path,
+            "route": route,
+            **summary,
+            "trace": trace.commands,
+        })
+
+    return summary
+
+
+def format_header(summary: dict) -> str:
+    """
+    回應 header 用的摘要，例如 commands=12; total_ms=30.5; max_repeat=8; flagged=repeated_query
+    """
+    parts = [
+        f"commands={summary['commands']}",
+        f"total_ms={summary['total_ms']}",
+        f"documents={summary['documents']}",
+        f"max_repeat={summary['max_repeat']}",
+    ]
+    if summary["flagged"]:
+        parts.append(f"flagged={','.join(summary['flagged'])}")
+    return "; ".join(parts)
+
+
+def get_flagged() -> list[dict]:
+    """
+    最近被標記的請求（由新到舊）
+    """
+    return list(reversed(_flagged))
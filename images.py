@@ -0,0 +1,68 @@
+import io
+import os
+
+# 上傳圖片時產生的衍生尺寸（最長邊像素）
+DERIVATIVE_SIZES = {
+    "thumb": int(os.getenv("IMAGE_THUMB_SIZE", "200")),
+    "screen": int(os.getenv("IMAGE_SCREEN_SIZE", "1280")),
+}
+IMAGE_SIZES = ("original", *DERIVATIVE_SIZES)
+
+# JPEG 重新壓縮的品質
+DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "80"))
+ORIGINAL_QUALITY = int(os.getenv("IMAGE_ORIGINAL_QUALITY", "90"))
+
+
+def _encode_jpeg(image, quality: int) -> bytes:
+    # 不帶入任何 EXIF / ICC 以外的中繼資料
+    buffer = io.BytesIO()
+    image.save(
+        buffer,
+        format="JPEG",
+        quality=quality,
+        optimize=True,
+        progressive=True,
+        icc_profile=image.info.get("icc_profile"),
+    )
+    return buffer.getvalue()
+
+
+def generate_derivatives(content: bytes) -> dict[str, dict]:
+    """
+    產生圖片的各尺寸版本：依 EXIF 方向轉正後移除 EXIF，並重新壓縮為 JPEG。
+
+    參數:
+    - content: 原始圖片內容
+
+    返回:
+    - {"original" | "thumb" | "screen": {"data", "width", "height"}}
+      原圖小於某個尺寸時，該尺寸直接沿用原始尺寸的版本（同一個物件）
+
+    Pillow 在此才載入，沒有安裝時拋出 ImportError，呼叫端會改為只儲存原始檔案
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.load()
+
+    results = {}
+    original = _encode_jpeg(image, ORIGINAL_QUALITY)
+    results["original"] = {"data": original, "width": image.width, "height": image.height}
+
+    for name, max_side in DERIVATIVE_SIZES.items():
+        if max(image.width, image.height) <= max_side:
+            # 原圖已經夠小，直接沿用原始尺寸的版本
+            results[name] = results["original"]
+            continue
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        results[name] = {
+            "data": _encode_jpeg(resized, DERIVATIVE_QUALITY),
+            "width": resized.width,
+            "height": resized.height,
+        }
+
+    return results
@@ -0,0 +1,197 @@
+import asyncio
+import datetime
+import os
+import random
+
+import db
+import mistral
+import transcription
+import logs
+
+logger = logs.get_logger(__name__)
+
+# 背景工作設定，可用環境變數調整
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))                        # worker 數量
+JOB_DEBOUNCE_SECONDS = int(os.getenv("JOB_DEBOUNCE_SECONDS", "30"))     # 同一篇筆記連續儲存時，最後一次儲存後多久才執行
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))              # 最多嘗試次數
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "30")) # 重試間隔基準，每次失敗加倍
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))          # 單一工作最長執行時間
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))            # 沒有工作時的輪詢間隔
+
+AUTO_TRANSCRIBE_AUDIO = os.getenv("AUTO_TRANSCRIBE_AUDIO", "1") == "1"  # 上傳音訊後自動在背景轉錄
+
+ENRICH_NOTE = "enrich_note"
+TRANSCRIBE_AUDIO = "transcribe_audio"
+
+_worker_tasks = []
+_wake_event = None
+
+
+async def enrich_note(client, user_id: str, note_id: str, openai_client) -> dict:
+    """
+    筆記上傳後的 AI 加值處理：生成 hashtags 並提取行程
+
+    返回:
+    - 處理結果
+    """
+    hashtags = await mistral.generate_hashtag_from_note(client, user_id, note_id, openai_client)
+    events = await mistral.get_event_link_from_note(client, user_id, note_id, openai_client)
+
+    # get_event_link_from_note 失敗時回傳錯誤字串，交由重試機制處理
+    if not isinstance(events, list):
+        raise RuntimeError(f"行程提取失敗: {events}")
+
+    return {"hashtags": hashtags, "event_count": len(events)}
+
+
+async def transcribe_audio(client, user_id: str, note_id: str, openai_client) -> dict:
+    """
+    上傳音訊後的背景轉錄：轉錄筆記中尚未轉錄的音訊行並寫回文字
+    """
+    return await transcription.transcribe_note_audio(openai_client, client, user_id, note_id)
+
+JOB_HANDLERS = {
+    ENRICH_NOTE: enrich_note,
+    TRANSCRIBE_AUDIO: transcribe_audio,
+}
+
+
+async def enqueue(client, user_id: str, note_id: str, kind: str, delay_seconds: float = JOB_DEBOUNCE_SECONDS) -> str:
+    """
+    排入背景工作。短時間內重複排入同一篇筆記的同類工作只會保留一個。
+
+    返回:
+    - 工作 ID
+    """
+    run_after = datetime.datetime.now() + datetime.timedelta(seconds=delay_seconds)
+    job_id = await db.enqueue_job(client, user_id, note_id, kind, run_after, JOB_MAX_ATTEMPTS)
+
+    if _wake_event is not None:
+        _wake_event.set()
+
+    return job_id
+
+
+async def enqueue_enrichment(client, user_id: str, note_id: str) -> str:
+    """
+    排入筆記的 AI 加值工作
+    """
+    return await enqueue(client, user_id, note_id, ENRICH_NOTE)
+
+
+async def enqueue_transcription(client, user_id: str, note_id: str) -> str:
+    """
+    排入筆記音訊的背景轉錄工作。不需要等待連續上傳結束，以較短的延遲執行。
+    """
+    return await enqueue(client, user_id, note_id, TRANSCRIBE_AUDIO, delay_seconds=1)
+
+
+async def run_job(client, job: dict, openai_client):
+    """
+    執行單一工作，失敗時依指數退避重新排入
+    """
+    handler = JOB_HANDLERS.get(job["kind"])
+
+    try:
+        if handler is None:
+            raise ValueError(f"未知的工作類型: {job['kind']}")
+
+        result = await asyncio.wait_for(
+            handler(client, job["user_id"], job["note_id"], openai_client),
+            timeout=JOB_LEASE_SECONDS
+        )
+        await db.complete_job(client, job["_id"], result)
+        logger.info("工作完成", job_id=job["_id"], kind=job["kind"], result=result)
+
+    except Exception as e:
+        retry_at = None
+        if handler is not None and job["attempts"] < job.get("max_attempts", JOB_MAX_ATTEMPTS):
+            delay = JOB_RETRY_BASE_SECONDS * (2 ** (job["attempts"] - 1))
+            delay *= random.uniform(0.8, 1.2)
+            retry_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+
+        await db.fail_job(client, job["_id"], str(e), retry_at)
+        logger.warning("工作執行失敗", job_id=job["_id"], kind=job["kind"], attempt=job["attempts"], retry_at=retry_at, error=e)
+
+
+async def _worker_loop(client, openai_client):
+    while True:
+        try:
+            lease_until = datetime.datetime.now() + datetime.timedelta(seconds=JOB_LEASE_SECONDS)
+            job = await db.claim_next_job(client, lease_until)
+        except Exception as e:
+            logger.error("取得背景工作時發生錯誤", error=e)
+            job = None
+
+        if job is None:
+            # 沒有工作時等待新工作排入或輪詢逾時
+            try:
+                await asyncio.wait_for(_wake_event.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _wake_event.clear()
+            continue
+
+        await run_job(client, job, openai_client)
+
+
+def start_job_workers(client, openai_client):
+    """
+    啟動背景工作的 worker，需在 event loop 中呼叫。索引由 db.ensure_indexes 在啟動時建立。
+    """
+    global _wake_event
+
+    if client is None or _worker_tasks:
+        return
+
+    _wake_event = asyncio.Event()
+
+    async def _start():
+        try:
+            requeued = await db.requeue_expired_jobs(client)
+            if requeued:
+                logger.info("重新排入中斷的工作", requeued=requeued)
+        except Exception as e:
+            logger.error("重新排入中斷的工作時發生錯誤", error=e)
+        await _worker_loop(client, openai_client)
+
+    for _ in range(JOB_WORKERS):
+        _worker_tasks.append(asyncio.create_task(_start()))
+    logger.info("已啟動背景工作 worker", workers=JOB_WORKERS)
+
+
+async def stop_job_workers():
+    """
+    停止所有 worker。執行中的工作會在租約到期後由下次啟動時重新排入。
+    """
+    global _wake_event
+
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+    _wake_event = None
+    logger.info("背景工作 worker 已停止")
+
+
+def serialize_job(job: dict) -> dict:
+    """
+    將工作文件轉換為 API 回應格式
+    """
+    def _iso(value):
+        return value.isoformat() if isinstance(value, datetime.datetime) else None
+
+    return {
+        "job_id": str(job["_id"]),
+        "kind": job.get("kind"),
+        "user_id": job.get("user_id"),
+        "note_id": job.get("note_id"),
+        "status": job.get("status"),
+        "attempts": job.get("attempts", 0),
+        "max_attempts": job.get("max_attempts", JOB_MAX_ATTEMPTS),
+        "run_after": _iso(job.get("run_after")),
+        "created_at": _iso(job.get("created_at")),
+        "finished_at": _iso(job.get("finished_at")),
+        "last_error": job.get("last_error"),
+        "result": job.get("result"),
+    }
@@ -0,0 +1,398 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+import logs
+import metrics
+
+logger = logs.get_logger(__name__)
+
+# 外部 LLM / 語音轉文字呼叫的共用閘道設定，可用環境變數調整
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))              # 同時進行的呼叫數上限
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+LLM_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", "30"))  # 排隊超過這個時間直接失敗
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))  # 連續失敗幾次後斷路
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))         # 斷路後多久再試
+
+# 會重試的 HTTP 狀態碼
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# 沒有狀態碼但應重試的錯誤類型（連線失敗、逾時）
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "TimeoutError", "ConnectionError"}
+
+
+class LLMUnavailableError(Exception):
+    """
+    外部 LLM 服務暫時無法使用（斷路中、重試用盡或排隊逾時）
+    """
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    權杖桶限流，容量為每分鐘上限，依時間持續補充
+    """
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float, deadline: float) -> float:
+        """
+        取得 amount 個權杖，必要時等待。超過 deadline 仍無法取得時拋出 LLMUnavailableError。
+
+        返回:
+        - 等待的秒數
+        """
+        # 單次需求超過容量時以容量計算，避免永遠等不到
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+                if time.monotonic() + wait > deadline:
+                    raise LLMUnavailableError("LLM 呼叫排隊逾時", retry_after=wait)
+                await asyncio.sleep(wait)
+                waited += wait
+
+    def adjust(self, delta: float):
+        """
+        依實際用量修正預估值，delta 為正代表多扣、為負代表退還
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    def pause(self, seconds: float):
+        """
+        收到 Retry-After 時清空權杖，讓後續請求至少等待指定秒數
+        """
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class CircuitBreaker:
+    """
+    斷路器：連續失敗達門檻後進入 open 狀態直接拒絕呼叫，
+    冷卻時間過後進入 half_open 只放行一個試探呼叫。
+    """
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.open_count = 0
+
+    def before_call(self) -> bool:
+        """
+        檢查是否可以呼叫，斷路中或其他呼叫正在恢復檢測時拋出 LLMUnavailableError
+
+        返回:
+        - 這次呼叫是否為半開狀態下的恢復檢測，是的話結束時需呼叫 release_trial
+        """
+        if self.state == "open":
+            remaining = self.opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                raise LLMUnavailableError("LLM 服務暫時無法使用（斷路中）", retry_after=remaining)
+            self.state = "half_open"
+            self.trial_in_flight = False
+
+        if self.state == "half_open":
+            if self.trial_in_flight:
+                raise LLMUnavailableError("LLM 服務暫時無法使用（恢復檢測中）", retry_after=1.0)
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self, trial: bool):
+        """
+        恢復檢測沒有得到結果（排隊逾時或請求本身有誤）時釋放，讓下一個呼叫重新檢測。
+        只有取得檢測資格的呼叫（trial 為 True）才會清除。
+        """
+        if trial:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.open_count += 1
+                logger.warning("LLM 斷路器開啟", failures=self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+def _status_code(error: Exception) -> int | None:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def _retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is not None:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+class LLMGateway:
+    """
+    所有外部 LLM 與語音轉文字呼叫的共用出口，負責限流、重試與斷路
+    """
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+    ):
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_OPEN_SECONDS)
+        self.stats = {
+            "queued": 0,             # 目前排隊中的呼叫
+            "in_flight": 0,          # 目前進行中的呼叫
+            "calls_total": 0,
+            "success_total": 0,
+            "failure_total": 0,
+            "retry_total": 0,
+            "throttled_total": 0,    # 因限流而等待的次數
+            "throttle_wait_seconds": 0.0,
+            "retry_after_total": 0,  # 收到 Retry-After 的次數
+            "rejected_total": 0,     # 斷路或排隊逾時而直接失敗的次數
+        }
+
+    async def _acquire(self, tokens: int) -> bool:
+        """
+        通過斷路器並取得限流權杖與並行名額，結束時需呼叫 _release
+
+        返回:
+        - 這次呼叫是否為半開狀態下的恢復檢測
+        """
+        deadline = time.monotonic() + LLM_MAX_QUEUE_WAIT_SECONDS
+        trial = False
+        try:
+            trial = self.breaker.before_call()
+            self.stats["queued"] += 1
+            try:
+                waited = await self.request_bucket.acquire(1, deadline)
+                waited += await self.token_bucket.acquire(tokens, deadline)
+                if waited > 0:
+                    self.stats["throttled_total"] += 1
+                    self.stats["throttle_wait_seconds"] += waited
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=max(deadline - time.monotonic(), 0.001))
+            except asyncio.TimeoutError:
+                raise LLMUnavailableError("LLM 呼叫排隊逾時", retry_after=1.0)
+            finally:
+                self.stats["queued"] -= 1
+        except LLMUnavailableError:
+            # 被斷路拒絕的呼叫 trial 為 False，不會清除正在進行的恢復檢測
+            self.breaker.release_trial(trial)
+            self.stats["rejected_total"] += 1
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release_trial(trial)
+            raise
+
+        self.stats["in_flight"] += 1
+        return trial
+
+    def _release(self):
+        self.stats["in_flight"] -= 1
+        self.semaphore.release()
+
+    def _record_failure(self, error: Exception, trial: bool) -> bool:
+        """
+        記錄失敗的呼叫，返回錯誤是否可重試
+        """
+        retryable = is_retryable(error)
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            # 請求本身有誤（例如 400），不代表服務異常
+            self.breaker.release_trial(trial)
+        self.stats["failure_total"] += 1
+        return retryable
+
+    async def call(self, fn, *args, tokens: int = 0, operation: str = "other", **kwargs):
+        """
+        在執行緒中呼叫同步的 SDK 函數 fn(*args, **kwargs)，套用限流、重試與斷路
+
+        參數:
+        - fn: 要呼叫的同步函數，例如 openai_client.chat.completions.create
+        - tokens: 預估的 token 用量（prompt + 輸出上限），用於每分鐘 token 限流
+        - operation: 呼叫的用途（例如 summary、hashtag），作為指標的 label
+
+        返回:
+        - fn 的回傳值
+        """
+        self.stats["calls_total"] += 1
+        attempt = 0
+
+        while True:
+            trial = await self._acquire(tokens)
+            model = kwargs.get("model", "unknown")
+            started_at = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(fn, *args, **kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release_trial(trial)
+                raise
+            except Exception as e:
+                metrics.LLM_CALL_DURATION.observe(operation, model, "failure", value=time.perf_counter() - started_at)
+                if not self._record_failure(e, trial):
+                    raise
+                if attempt >= self.max_retries:
+                    raise LLMUnavailableError(f"LLM 呼叫重試 {attempt} 次後仍失敗: {e}", retry_after=_retry_after(e)) from e
+
+                delay = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt))
+                delay = random.uniform(0, delay)  # full jitter
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    self.stats["retry_after_total"] += 1
+                    delay = max(delay, retry_after)
+                    self.request_bucket.pause(retry_after)
+
+                attempt += 1
+                self.stats["retry_total"] += 1
+                logger.warning("LLM 呼叫失敗，稍後重試", attempt=attempt, delay_seconds=round(delay, 1), error=e)
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self._release()
+
+            self.breaker.record_success()
+            self.stats["success_total"] += 1
+            metrics.LLM_CALL_DURATION.observe(operation, model, "success", value=time.perf_counter() - started_at)
+            metrics.observe_llm_usage(operation, model, getattr(result, "usage", None))
+
+            # 依回應中的實際 token 用量修正預估
+            usage = getattr(result, "usage", None)
+            total_tokens = getattr(usage, "total_tokens", None)
+            if isinstance(total_tokens, int) and tokens:
+                self.token_bucket.adjust(total_tokens - tokens)
+
+            return result
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, operation: str = "other", model: str = "unknown"):
+        """
+        在整個 async with 區塊期間佔用一個呼叫名額，供串流回應使用：
+        call 在建立串流後就會返回，讀取片段時已不受並行上限與斷路器管理。
+
+        區塊內拋出的錯誤會計入斷路器與失敗統計，但不會重試（部分內容可能已送出）。
+
+        參數:
+        - tokens: 預估的 token 用量（prompt + 輸出上限）
+        - operation: 呼叫的用途，作為指標的 label
+        - model: 模型名稱，作為指標的 label
+        """
+        self.stats["calls_total"] += 1
+        trial = await self._acquire(tokens)
+        started_at = time.perf_counter()
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客戶端中途斷線，沒有得到結果
+            self.breaker.release_trial(trial)
+            raise
+        except Exception as e:
+            metrics.LLM_CALL_DURATION.observe(operation, model, "failure", value=time.perf_counter() - started_at)
+            self._record_failure(e, trial)
+            raise
+        else:
+            self.breaker.record_success()
+            self.stats["success_total"] += 1
+            metrics.LLM_CALL_DURATION.observe(operation, model, "success", value=time.perf_counter() - started_at)
+        finally:
+            self._release()
+
+    def get_stats(self) -> dict:
+        """
+        取得閘道的即時統計
+        """
+        return {
+            **self.stats,
+            "max_concurrency": self.max_concurrency,
+            "breaker_state": self.breaker.state,
+            "breaker_open_total": self.breaker.open_count,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+
+gateway = LLMGateway()
+
+
+async def call(fn, *args, tokens: int = 0, operation: str = "other", **kwargs):
+    """
+    透過共用閘道呼叫外部 LLM，見 LLMGateway.call
+    """
+    return await gateway.call(fn, *args, tokens=tokens, operation=operation, **kwargs)
+
+
+def slot(tokens: int = 0, operation: str = "other", model: str = "unknown"):
+    """
+    在共用閘道佔用一個呼叫名額直到區塊結束，見 LLMGateway.slot
+    """
+    return gateway.slot(tokens=tokens, operation=operation, model=model)
+
+
+def get_stats() -> dict:
+    return gateway.get_stats()
+
+
+LLM_GATEWAY_CALLS = metrics.Gauge(
+    "llm_gateway_calls", "LLM 閘道中排隊與進行中的呼叫數", ("state",),
+    collect=lambda: {("queued",): gateway.stats["queued"], ("in_flight",): gateway.stats["in_flight"]}
+)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import logs
+
+logger = logs.get_logger(__name__)
+
+# LLM 提供者設定：openai（預設）或 local（離線的模擬提供者，用於壓力測試與延遲量測）
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+
+# 模擬提供者的設定
+LOCAL_LLM_SEED = int(os.getenv("LOCAL_LLM_SEED", "42"))
+LOCAL_LLM_LATENCY = os.getenv("LOCAL_LLM_LATENCY", "lognormal:800,0.5")            # 完整回應的延遲分佈（毫秒）
+LOCAL_LLM_FIRST_TOKEN_LATENCY = os.getenv("LOCAL_LLM_FIRST_TOKEN_LATENCY", "lognormal:300,0.4")  # 串流首個 token 的延遲
+LOCAL_LLM_TOKEN_INTERVAL = os.getenv("LOCAL_LLM_TOKEN_INTERVAL", "fixed:20")       # 串流每個 token 之間的間隔
+LOCAL_LLM_TRANSCRIBE_LATENCY = os.getenv("LOCAL_LLM_TRANSCRIBE_LATENCY", "lognormal:1500,0.5")
+LOCAL_LLM_ERROR_RATE = float(os.getenv("LOCAL_LLM_ERROR_RATE", "0"))               # 模擬錯誤的機率
+LOCAL_LLM_ERROR_STATUS = int(os.getenv("LOCAL_LLM_ERROR_STATUS", "429"))           # 模擬錯誤的 HTTP 狀態碼
+LOCAL_LLM_RETRY_AFTER = os.getenv("LOCAL_LLM_RETRY_AFTER", "1")                    # 模擬錯誤附帶的 Retry-After
+
+
+class LocalProviderError(Exception):
+    """
+    模擬提供者產生的錯誤，欄位與 OpenAI SDK 的 APIStatusError 相容，llm_gateway 會以相同方式處理
+    """
+    def __init__(self, status_code: int, retry_after: str | None = None):
+        super().__init__(f"模擬提供者錯誤 (HTTP {status_code})")
+        self.status_code = status_code
+        headers = {"retry-after": retry_after} if retry_after else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def parse_latency(spec: str):
+    """
+    解析延遲分佈設定，返回一個以 random.Random 產生秒數的函數。
+
+    支援格式（單位為毫秒）:
+    - fixed:200
+    - uniform:100,500
+    - lognormal:800,0.5   （中位數, sigma）
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        sigma = values[1] if len(values) > 1 else 0.5
+        return lambda rng: rng.lognormvariate(mu, sigma) / 1000
+    raise ValueError(f"無法解析的延遲設定: {spec}")
+
+
+def _tokenize(text: str) -> list[str]:
+    # 中文逐字、其他文字以單字為單位切分，模擬串流的 token
+    return re.findall(r"[一-鿿]|[^一-鿿\s]+\s*|\s+", text)
+
+
+class LocalLLMClient:
+    """
+    離線的 LLM 模擬提供者，介面與 OpenAI 客戶端中本專案用到的部分相同：
+    chat.completions.create 與 audio.transcriptions.create。
+
+    相同的輸入永遠得到相同的輸出；延遲與錯誤依設定的分佈以固定種子隨機產生。
+    """
+    def __init__(
+        self,
+        seed: int = LOCAL_LLM_SEED,
+        latency: str = LOCAL_LLM_LATENCY,
+        first_token_latency: str = LOCAL_LLM_FIRST_TOKEN_LATENCY,
+        token_interval: str = LOCAL_LLM_TOKEN_INTERVAL,
+        transcribe_latency: str = LOCAL_LLM_TRANSCRIBE_LATENCY,
+        error_rate: float = LOCAL_LLM_ERROR_RATE,
+        error_status: int = LOCAL_LLM_ERROR_STATUS,
+        retry_after: str | None = LOCAL_LLM_RETRY_AFTER,
+    ):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.latency = parse_latency(latency)
+        self.first_token_latency = parse_latency(first_token_latency)
+        self.token_interval = parse_latency(token_interval)
+        self.transcribe_latency = parse_latency(transcribe_latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._create_transcription))
+
+    def _sample(self, distribution) -> float:
+        with self.lock:
+            return distribution(self.rng)
+
+    def _maybe_fail(self):
+        with self.lock:
+            failed = self.rng.random() < self.error_rate
+        if failed:
+            raise LocalProviderError(self.error_status, self.retry_after)
+
+    def _reply_for(self, messages: list[dict], max_tokens: int | None) -> str:
+        system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user_prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        digest = hashlib.sha256(f"{system_prompt}\0{user_prompt}".encode("utf-8")).digest()
+
+        if "hashtag" in system_prompt:
+            pool = ["日常", "學習", "朋友", "家人", "工作", "運動", "美食", "旅行", "心情", "電影"]
+            start = digest[0] % len(pool)
+            return ",".join(pool[(start + i * 3) % len(pool)] for i in range(3 + digest[1] % 4))
+
+        if "行程提取" in system_prompt:
+            match = re.search(r"今天的日期是 (\d{8})", user_prompt)
+            if not match or digest[0] % 3 == 0:
+                return "[]"
+            day = int(match.group(1)[-2:])
+            date = f"{match.group(1)[:6]}{min(day + 1 + digest[1] % 3, 28):02d}"
+            return json.dumps([{"time": date, "event": "模擬行程"}], ensure_ascii=False)
+
+        # 其他請求：以使用者內容的片段組成固定的摘要
+        content = re.sub(r"\s+", "", user_prompt.split("日記內容", 1)[-1]).lstrip("：:")
+        excerpt = content[:40] if content else "今天的生活"
+        reply = f"這段時間的重點是{excerpt}，整體感受平穩而充實。"
+        if max_tokens:
+            reply = reply[:max_tokens]
+        return reply
+
+    def _usage(self, messages: list[dict], reply: str):
+        prompt_tokens = sum(len(m["content"]) for m in messages)
+        completion_tokens = len(_tokenize(reply))
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    def _create_chat_completion(self, model: str, messages: list[dict], stream: bool = False, max_tokens: int = None, **kwargs):
+        reply = self._reply_for(messages, max_tokens)
+
+        if stream:
+            time.sleep(self._sample(self.first_token_latency))
+            self._maybe_fail()
+            return self._stream(reply)
+
+        time.sleep(self._sample(self.latency))
+        self._maybe_fail()
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=reply), finish_reason="stop")],
+            usage=self._usage(messages, reply),
+        )
+
+    def _stream(self, reply: str):
+        for index, token in enumerate(_tokenize(reply)):
+            if index:
+                time.sleep(self._sample(self.token_interval))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")])
+
+    def _create_transcription(self, model: str, file, language: str = None, response_format: str = "text", **kwargs):
+        audio = file.read() if hasattr(file, "read") else bytes(file)
+        time.sleep(self._sample(self.transcribe_latency))
+        self._maybe_fail()
+
+        digest = hashlib.sha256(audio).hexdigest()
+        text = f"模擬轉錄內容 {digest[:8]}，長度 {len(audio)} bytes。"
+        if response_format == "text":
+            return text
+        return SimpleNamespace(text=text)
+
+
+def create_llm_client(api_key: str = None, provider: str = LLM_PROVIDER):
+    """
+    依設定建立 LLM 客戶端
+
+    參數:
+    - api_key: OpenAI API 金鑰（provider 為 openai 時使用）
+    - provider: openai 或 local
+
+    返回:
+    - 具有 chat.completions.create 與 audio.transcriptions.create 的客戶端
+    """
+    if provider == "local":
+        logger.info("使用本地模擬 LLM 提供者")
+        return LocalLLMClient()
+
+    if provider != "openai":
+        raise ValueError(f"未知的 LLM 提供者: {provider}")
+
+    from openai import OpenAI
+
+    # 重試交由 llm_gateway 統一處理，避免 SDK 與閘道重複重試
+    return OpenAI(api_key=api_key, max_retries=0)
@@ -0,0 +1,474 @@
+"""
+端到端 HTTP 壓力測試
+
+以實際流量為模型的情境（開啟 App、讀取筆記、逐行儲存筆記、搜尋、摘要、語音轉文字）
+依目標速率對 API 發送請求，輸出每個端點與情境的延遲分位數、吞吐量與錯誤率。
+
+先以本機 mongod 與模擬 LLM 啟動 API：
+
+    MONGODB_URI=mongodb://localhost:27017 LLM_PROVIDER=local uvicorn main:app
+
+再執行（每個階段為 秒數:每秒開始的情境數，速率在階段內線性變化）：
+
+    python loadtest.py --base-url http://localhost:8000 --stages 30:5,60:20,30:20 --output load.json
+"""
+import argparse
+import array
+import asyncio
+import datetime
+import functools
+import io
+import json
+import math
+import random
+import sys
+import time
+import uuid
+import wave
+
+import aiohttp
+
+SCENARIOS = ("open_app", "read_note", "save_note", "search", "summarize", "transcribe")
+DEFAULT_MIX = "open_app=30,read_note=30,save_note=15,search=10,summarize=10,transcribe=5"
+
+SEARCH_WORDS = ("今天", "咖啡", "散步", "會議", "朋友", "morning", "project", "music", "dinner", "walk")
+
+
+def parse_stages(spec: str) -> list[tuple[float, float]]:
+    """
+    解析 "30:5,60:20" 形式的階段設定
+
+    返回:
+    - [(秒數, 階段結束時的每秒情境數), ...]
+    """
+    stages = []
+    for part in spec.split(","):
+        duration, _, rate = part.strip().partition(":")
+        stages.append((float(duration), float(rate)))
+    return stages
+
+
+def rate_at(stages: list[tuple[float, float]], elapsed: float) -> float | None:
+    """
+    目前的目標速率，從上一個階段的速率線性變化到此階段的速率；所有階段結束後返回 None
+    """
+    previous_rate = 0.0
+    for duration, rate in stages:
+        if elapsed < duration:
+            return previous_rate + (rate - previous_rate) * (elapsed / duration if duration else 1)
+        elapsed -= duration
+        previous_rate = rate
+    return None
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"未知的情境: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _percentile(values: list[float], percent: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return round(ordered[index], 2)
+
+
+@functools.lru_cache(maxsize=4)
+def _sine_samples(seconds: float, sample_rate: int) -> array.array:
+    frames = int(seconds * sample_rate)
+    return array.array("h", (int(8000 * math.sin(2 * math.pi * 220 * i / sample_rate)) for i in range(frames)))
+
+
+def make_wav(seconds: float, sample_rate: int = 16000, rng: random.Random = None) -> bytes:
+    """
+    產生單聲道 16-bit 的 WAV，內容為正弦波。
+
+    指定 rng 時以隨機相位開始並在開頭加入低音量雜訊，每個檔案的內容都不同；
+    否則伺服器依內容雜湊快取的轉錄結果會讓後續請求只量到快取查詢
+    """
+    samples = _sine_samples(seconds, sample_rate)
+    if rng is not None and samples:
+        offset = rng.randrange(len(samples))
+        samples = samples[offset:] + samples[:offset]
+        for i in range(min(len(samples), 256)):
+            samples[i] += rng.randint(-8, 8)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+class Stats:
+    """
+    依端點與情境累計延遲與狀態，並記錄每秒的請求數
+    """
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.endpoints = {}
+        self.scenarios = {}
+        self.timeline = {}
+        self.dropped = 0
+        self.target_scenarios = 0.0  # 依目標速率應開始的情境數
+        self.started_scenarios = 0
+
+    def _bucket(self, table: dict, name: str) -> dict:
+        bucket = table.get(name)
+        if bucket is None:
+            bucket = table[name] = {"latencies": [], "statuses": {}, "errors": 0}
+        return bucket
+
+    def record_request(self, endpoint: str, latency_ms: float, status: int | None, error: bool):
+        bucket = self._bucket(self.endpoints, endpoint)
+        bucket["latencies"].append(latency_ms)
+        key = str(status) if status is not None else "exception"
+        bucket["statuses"][key] = bucket["statuses"].get(key, 0) + 1
+        bucket["errors"] += int(error)
+
+        second = int(time.perf_counter() - self.started_at)
+        point = self.timeline.setdefault(second, {"requests": 0, "errors": 0, "scenarios_started": 0})
+        point["requests"] += 1
+        point["errors"] += int(error)
+
+    def record_scenario_start(self):
+        self.started_scenarios += 1
+        second = int(time.perf_counter() - self.started_at)
+        point = self.timeline.setdefault(second, {"requests": 0, "errors": 0, "scenarios_started": 0})
+        point["scenarios_started"] += 1
+
+    def record_scenario(self, scenario: str, latency_ms: float, error: bool):
+        bucket = self._bucket(self.scenarios, scenario)
+        bucket["latencies"].append(latency_ms)
+        bucket["errors"] += int(error)
+
+    @staticmethod
+    def _summarize(bucket: dict, elapsed: float) -> dict:
+        latencies = bucket["latencies"]
+        count = len(latencies)
+        summary = {
+            "count": count,
+            "throughput_per_s": round(count / elapsed, 2) if elapsed > 0 else None,
+            "error_rate": round(bucket["errors"] / count, 4) if count else 0,
+            "p50_ms": _percentile(latencies, 50),
+            "p90_ms": _percentile(latencies, 90),
+            "p99_ms": _percentile(latencies, 99),
+            "max_ms": round(max(latencies), 2) if latencies else None,
+        }
+        if bucket["statuses"]:
+            summary["statuses"] = bucket["statuses"]
+        return summary
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "endpoints": {name: self._summarize(bucket, elapsed) for name, bucket in sorted(self.endpoints.items())},
+            "scenarios": {name: self._summarize(bucket, elapsed) for name, bucket in sorted(self.scenarios.items())},
+            "dropped_scenarios": self.dropped,
+            "target_scenarios": round(self.target_scenarios),
+            "started_scenarios": self.started_scenarios,
+            "target_rate_per_s": round(self.target_scenarios / elapsed, 2) if elapsed > 0 else None,
+            "achieved_rate_per_s": round(self.started_scenarios / elapsed, 2) if elapsed > 0 else None,
+            "timeline": [{"second": second, **point} for second, point in sorted(self.timeline.items())],
+        }
+
+
+class ScenarioError(Exception):
+    """
+    情境中的請求失敗，情境不再繼續
+    """
+
+
+class VirtualUser:
+    """
+    壓力測試使用的使用者與其已知的筆記
+    """
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.note_ids = []
+        self.headers = {}
+
+
+class LoadClient:
+    def __init__(self, session: aiohttp.ClientSession, base_url: str, stats: Stats | None):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+
+    async def request(self, user: VirtualUser, endpoint: str, method: str, path: str, **kwargs):
+        """
+        發送請求並記錄延遲。endpoint 為路由樣板，讓不同 ID 的請求歸在同一列。
+
+        返回:
+        - 回應內容（JSON 或文字）
+        """
+        started_at = time.perf_counter()
+        status = None
+        try:
+            async with self.session.request(method, self.base_url + path, headers=user.headers, **kwargs) as response:
+                status = response.status
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if self.stats is not None:
+                self.stats.record_request(endpoint, (time.perf_counter() - started_at) * 1000, None, True)
+            raise ScenarioError(f"{endpoint}: {type(e).__name__}") from e
+
+        error = status >= 400
+        if self.stats is not None:
+            self.stats.record_request(endpoint, (time.perf_counter() - started_at) * 1000, status, error)
+        if error:
+            raise ScenarioError(f"{endpoint}: HTTP {status}")
+        try:
+            return json.loads(body)
+        except ValueError:
+            return body.decode("utf-8", errors="replace")
+
+
+class Scenarios:
+    """
+    以實際使用情境組成的請求序列
+    """
+    def __init__(self, client: LoadClient, args, rng: random.Random):
+        self.client = client
+        self.args = args
+        self.rng = rng
+
+    def _wav(self) -> bytes:
+        return make_wav(self.args.audio_seconds, rng=self.rng)
+
+    def _text(self) -> str:
+        return " ".join(self.rng.choice(SEARCH_WORDS) for _ in range(self.args.words_per_line))
+
+    def _pick_note(self, user: VirtualUser) -> str:
+        if not user.note_ids:
+            raise ScenarioError("使用者沒有筆記")
+        return self.rng.choice(user.note_ids)
+
+    async def open_app(self, user: VirtualUser):
+        # App 開啟時同時載入筆記列表與通知
+        await asyncio.gather(
+            self.client.request(user, "GET /api/note_list/{user_id}", "GET", f"/api/note_list/{user.user_id}"),
+            self.client.request(user, "GET /api/notify/{user_id}", "GET", f"/api/notify/{user.user_id}"),
+        )
+
+    async def read_note(self, user: VirtualUser):
+        note_id = self._pick_note(user)
+        await self.client.request(
+            user, "GET /api/notes/{user_id}/{note_id}", "GET", f"/api/notes/{user.user_id}/{note_id}"
+        )
+
+    async def save_note(self, user: VirtualUser, lines: int = None, with_audio: bool = True):
+        # 新增筆記後逐行上傳，與 App 編輯時的行為相同
+        note_id = f"note_{uuid.uuid4().hex[:12]}"
+        await self.client.request(
+            user, "POST /api/create", "POST", "/api/create",
+            data={"user_id": user.user_id, "note_id": note_id}
+        )
+        for line_id in range(lines if lines is not None else self.args.save_lines):
+            form = aiohttp.FormData()
+            form.add_field("user_id", user.user_id)
+            form.add_field("note_id", note_id)
+            form.add_field("line_id", str(line_id))
+            if with_audio and self.args.audio_line_ratio > 0 and self.rng.random() < self.args.audio_line_ratio:
+                form.add_field("type", "audio")
+                form.add_field("audio", self._wav(), filename=f"line_{line_id}.wav", content_type="audio/wav")
+            else:
+                form.add_field("type", "text")
+                form.add_field("text", self._text())
+            await self.client.request(user, "POST /api/upload", "POST", "/api/upload", data=form)
+        user.note_ids.append(note_id)
+
+    async def search(self, user: VirtualUser):
+        await self.client.request(
+            user, "GET /api/search/{user_id}", "GET", f"/api/search/{user.user_id}",
+            params={"query": self.rng.choice(SEARCH_WORDS)}
+        )
+
+    async def summarize(self, user: VirtualUser):
+        note_id = self._pick_note(user)
+        await self.client.request(
+            user, "POST /api/summary", "POST", "/api/summary",
+            data={"user_id": user.user_id, "note_id": note_id}
+        )
+
+    async def transcribe(self, user: VirtualUser):
+        form = aiohttp.FormData()
+        form.add_field("audio", self._wav(), filename="recording.wav", content_type="audio/wav")
+        form.add_field("language", "zh-TW")
+        await self.client.request(user, "POST /api/audio/transcribe", "POST", "/api/audio/transcribe", data=form)
+
+
+async def authenticate(client: LoadClient, user: VirtualUser, password: str):
+    """
+    註冊（已存在時忽略）並登入，之後的請求帶上 access token
+    """
+    try:
+        await client.request(user, "POST /api/register", "POST", "/api/register", data={"username": user.user_id, "password": password})
+    except ScenarioError:
+        pass
+    tokens = await client.request(user, "POST /api/login", "POST", "/api/login", data={"username": user.user_id, "password": password})
+    user.headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+
+async def prepare_users(session: aiohttp.ClientSession, args, rng: random.Random) -> list[VirtualUser]:
+    """
+    建立使用者並預先寫入筆記，準備階段的請求不列入統計
+    """
+    client = LoadClient(session, args.base_url, stats=None)
+    scenarios = Scenarios(client, args, rng)
+    run_id = args.user_prefix or f"load_{uuid.uuid4().hex[:6]}"
+    users = [VirtualUser(f"{run_id}_{index}") for index in range(args.users)]
+    semaphore = asyncio.Semaphore(args.setup_concurrency)
+
+    async def prepare(user: VirtualUser):
+        async with semaphore:
+            if args.auth:
+                await authenticate(client, user, args.password)
+            for _ in range(args.seed_notes):
+                await scenarios.save_note(user, lines=args.seed_lines, with_audio=False)
+
+    await asyncio.gather(*(prepare(user) for user in users))
+    return users
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    stages = parse_stages(args.stages) if args.stages else [(args.ramp, args.rps), (args.duration, args.rps)]
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.max_in_flight * 2)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        print(f"準備 {args.users} 個使用者，每人 {args.seed_notes} 篇筆記…", file=sys.stderr)
+        users = await prepare_users(session, args, rng)
+
+        stats = Stats()
+        scenarios = Scenarios(LoadClient(session, args.base_url, stats), args, rng)
+        in_flight = set()
+
+        async def run_scenario(name: str, user: VirtualUser):
+            started_at = time.perf_counter()
+            error = False
+            try:
+                await getattr(scenarios, name)(user)
+            except ScenarioError:
+                error = True
+            stats.record_scenario(name, (time.perf_counter() - started_at) * 1000, error)
+
+        # 開放式負載：依目標速率開始情境，不等待先前的情境完成；進行中的情境達上限時捨棄並計數
+        tick = 0.01
+        budget = 0.0
+        started_at = last_tick = time.perf_counter()
+        last_report = 0
+        last_report_started = 0
+        while True:
+            now = time.perf_counter()
+            elapsed = now - started_at
+            rate = rate_at(stages, elapsed)
+            if rate is None:
+                break
+            # 依實際經過的時間累計；情境多時 event loop 忙碌，sleep(tick) 會比 tick 長很多
+            stats.target_scenarios += rate * (now - last_tick)
+            budget += rate * (now - last_tick)
+            last_tick = now
+            while budget >= 1:
+                budget -= 1
+                if len(in_flight) >= args.max_in_flight:
+                    stats.dropped += 1
+                    continue
+                name = rng.choices(names, weights)[0]
+                task = asyncio.create_task(run_scenario(name, rng.choice(users)))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                stats.record_scenario_start()
+            if int(elapsed) >= last_report + 10:
+                achieved = (stats.started_scenarios - last_report_started) / (int(elapsed) - last_report)
+                last_report = int(elapsed)
+                last_report_started = stats.started_scenarios
+                print(f"[{last_report:>4}s] 目標 {rate:.1f} 情境/秒，實際 {achieved:.1f}，進行中 {len(in_flight)}", file=sys.stderr)
+            await asyncio.sleep(tick)
+
+        load_seconds = time.perf_counter() - started_at
+        if in_flight:
+            await asyncio.wait(in_flight, timeout=args.drain_timeout)
+
+    return {
+        "meta": {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "base_url": args.base_url,
+            "stages": stages,
+            "mix": mix,
+            "users": args.users,
+            "load_seconds": round(load_seconds, 1),
+            "max_in_flight": args.max_in_flight,
+        },
+        **stats.report(load_seconds),
+    }
+
+
+def print_report(result: dict):
+    header = f"{'':<40} {'count':>7} {'rps':>8} {'err%':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"
+    for section in ("endpoints", "scenarios"):
+        print(f"\n{section}\n{header}", file=sys.stderr)
+        for name, row in result[section].items():
+            values = [row[key] if row[key] is not None else float("nan") for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")]
+            print(
+                f"{name:<40} {row['count']:>7} {row['throughput_per_s'] or 0:>8.2f} {row['error_rate'] * 100:>6.1f} "
+                + " ".join(f"{value:>9.1f}" for value in values),
+                file=sys.stderr
+            )
+    print(
+        f"\n情境速率: 目標 {result['target_rate_per_s'] or 0:.2f}/秒（{result['target_scenarios']} 個），"
+        f"實際 {result['achieved_rate_per_s'] or 0:.2f}/秒（{result['started_scenarios']} 個）",
+        file=sys.stderr
+    )
+    if result["dropped_scenarios"]:
+        print(f"\n進行中的情境達上限而捨棄: {result['dropped_scenarios']}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="端到端 HTTP 壓力測試")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--stages", help="階段設定，例如 30:5,60:20（秒數:每秒開始的情境數），設定時忽略 --rps/--ramp/--duration")
+    parser.add_argument("--rps", type=float, default=10, help="每秒開始的情境數")
+    parser.add_argument("--ramp", type=float, default=10, help="從 0 增加到 --rps 的秒數")
+    parser.add_argument("--duration", type=float, default=60, help="維持 --rps 的秒數")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="情境比重")
+    parser.add_argument("--users", type=int, default=50, help="虛擬使用者數")
+    parser.add_argument("--user-prefix", help="使用者 ID 前綴，預設每次執行產生新的使用者")
+    parser.add_argument("--seed-notes", type=int, default=5, help="準備階段每個使用者的筆記數")
+    parser.add_argument("--seed-lines", type=int, default=10, help="準備階段每篇筆記的行數")
+    parser.add_argument("--save-lines", type=int, default=5, help="save_note 情境上傳的行數")
+    parser.add_argument("--words-per-line", type=int, default=12)
+    parser.add_argument("--audio-seconds", type=float, default=5, help="語音行與轉錄使用的 WAV 長度")
+    parser.add_argument("--audio-line-ratio", type=float, default=0.1, help="save_note 中語音行的比例")
+    parser.add_argument("--auth", action="store_true", help="註冊並登入，請求帶上 access token（AUTH_REQUIRED=1 時需要）")
+    parser.add_argument("--password", default="load-test-password")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="同時進行的情境上限")
+    parser.add_argument("--setup-concurrency", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60, help="單一請求的逾時秒數")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="結束後等待進行中情境的秒數")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="結果 JSON 的路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
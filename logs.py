@@ -0,0 +1,207 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import zlib
+
+# 日誌設定，可用環境變數調整
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                               # json 或 text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))                 # 佇列滿時丟棄新的紀錄，不阻塞請求
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))  # DEBUG 紀錄的取樣比例，以請求為單位
+LOG_MAX_FIELD_LENGTH = int(os.getenv("LOG_MAX_FIELD_LENGTH", "200"))       # 欄位值超過此長度會被截斷
+
+# 這些欄位只記錄長度，不記錄內容
+REDACTED_FIELDS = {
+    "password",
+    "hashed_password",
+    "token",
+    "access_token",
+    "refresh_token",
+    "text",
+    "content",
+    "custom_prompt",
+    "query",
+    "chunk",
+}
+
+# 目前請求的 correlation ID，asyncio.to_thread 會一併帶入執行緒
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+LOG_STATS = {
+    "dropped": 0,
+}
+
+_listener = None
+
+
+def _redact(key: str, value):
+    if value is None:
+        return None
+    if key in REDACTED_FIELDS:
+        size = len(value) if hasattr(value, "__len__") else None
+        return f"[REDACTED len={size}]" if size is not None else "[REDACTED]"
+    if isinstance(value, (int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple, set)) and len(value) <= 20:
+        return [_redact(key, item) for item in value]
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > LOG_MAX_FIELD_LENGTH:
+        text = f"{text[:LOG_MAX_FIELD_LENGTH]}…(+{len(text) - LOG_MAX_FIELD_LENGTH})"
+    return text
+
+
+def redact(fields: dict) -> dict:
+    """
+    對欄位套用與日誌相同的遮蔽與截斷規則
+    """
+    return {key: _redact(key, value) for key, value in fields.items()}
+
+
+class StructuredLogger:
+    """
+    以關鍵字參數記錄結構化欄位的 logger:
+
+        logger.info("筆記已儲存", user_id=user_id, note_id=note_id)
+
+    欄位會在呼叫端的執行緒中完成遮蔽與截斷，輸出交由背景執行緒處理。
+    """
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, message: str, exc_info=None, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        fields = redact(fields)
+        self._logger.log(level, message, exc_info=exc_info, extra={"fields": fields}, stacklevel=3)
+
+    def debug(self, message: str, **fields):
+        self._log(logging.DEBUG, message, **fields)
+
+    def info(self, message: str, **fields):
+        self._log(logging.INFO, message, **fields)
+
+    def warning(self, message: str, **fields):
+        self._log(logging.WARNING, message, **fields)
+
+    def error(self, message: str, **fields):
+        self._log(logging.ERROR, message, **fields)
+
+    def exception(self, message: str, **fields):
+        self._log(logging.ERROR, message, exc_info=True, **fields)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(name)
+
+
+class ContextFilter(logging.Filter):
+    """
+    在呼叫端的執行緒中附加 correlation ID，並對 DEBUG 紀錄取樣。
+    同一個請求的 DEBUG 紀錄會一起保留或一起捨棄。
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        record.request_id = request_id
+        if record.levelno <= logging.DEBUG and LOG_DEBUG_SAMPLE_RATE < 1:
+            if request_id is not None:
+                sample = (zlib.crc32(request_id.encode("utf-8")) % 10000) / 10000
+            else:
+                sample = random.random()
+            return sample < LOG_DEBUG_SAMPLE_RATE
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    佇列滿時丟棄紀錄並計數，而不是阻塞或印出錯誤
+    """
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_STATS["dropped"] += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 例外在呼叫端先格式化，背景執行緒只需要寫出字串
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        request_id = getattr(record, "request_id", None) or "-"
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{timestamp} {record.levelname:<7} [{request_id}] {record.name}: {record.getMessage()} {fields}".rstrip()
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+def setup_logging():
+    """
+    設定 root logger：紀錄放入佇列後立即返回，由背景執行緒寫到 stdout。重複呼叫不會重複設定。
+    """
+    global _listener
+
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    停止背景執行緒並寫出佇列中剩餘的紀錄
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_stats() -> dict:
+    return {
+        **LOG_STATS,
+        "queued": _listener.queue.qsize() if _listener is not None else 0,
+        "level": LOG_LEVEL,
+        "debug_sample_rate": LOG_DEBUG_SAMPLE_RATE,
+    }
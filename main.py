@@ -1,32 +1,235 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, status
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, Depends, File, UploadFile, Form, HTTPException, Request, status
+from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
+from contextlib import asynccontextmanager
 
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import os
+import asyncio
 import aiohttp
-import io
 import json
+import bson
+import gridfs
 from bson import ObjectId, json_util
 import datetime
-from openai import OpenAI
 
 import mistral
 import db
 import security
+import auth
+import scheduler
+import jobs
+import llm_gateway
+import llm_provider
+import transcription
+import images
+import logs
+import metrics
+import profiling
+import dbtrace
+import slowquery
+import uuid
+import time
+
+logs.setup_logging()
+logger = logs.get_logger(__name__)
 
-mistral_key = os.getenv("MISTRAL_API_KEY")
 openai_api_key = os.environ.get('OPENAI_API_KEY')
-db_password = os.getenv("DB_PASSWORD")
-database = db.connect_to_mongodb_atlas()
-mistral_client = mistral.Mistral(api_key=mistral_key)
-openai_client = OpenAI(api_key=openai_api_key)
+
+# MongoDB 與 LLM 客戶端在 lifespan 中建立，匯入模組時不做任何連線
+database = None
+openai_client = None
+
+# 啟動與就緒檢查設定
+STARTUP_FAIL_FAST = os.getenv("STARTUP_FAIL_FAST", "1") == "1"                  # 無法連接 MongoDB 時中止啟動，而不是帶著無法使用的連線啟動
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"                        # 啟動後在背景預先建立連線池
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "2"))  # /readyz 檢查 MongoDB 的逾時
+
+# 續傳上傳設定
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))               # GridFS chunk 大小
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))       # 單一檔案大小上限
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))  # 最後一次寫入後多久未完成即清除
+UPLOAD_WRITER_LEASE_SECONDS = int(os.getenv("UPLOAD_WRITER_LEASE_SECONDS", "60"))       # 寫入中的請求持有工作階段的時間，每寫入一段延長
+UPLOAD_EXTENSIONS = {"audio": ".wav", "video": ".mp4"}
+
+async def _ensure_indexes(client) -> bool:
+    try:
+        await asyncio.to_thread(db.ensure_indexes, client, transcription.TRANSCRIPT_CACHE_TTL_SECONDS)
+        return True
+    except Exception as e:
+        logger.error("建立索引時發生錯誤", error=e)
+        return False
+
+async def _warmup(client):
+    # 先建立連線池中的連線，讓第一批請求不需要等待 TLS 握手
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            asyncio.to_thread(client.admin.command, "ping")
+            for _ in range(max(1, db.MONGODB_MIN_POOL_SIZE))
+        ))
+        logger.info("連線池預熱完成", duration_ms=round((time.perf_counter() - started_at) * 1000, 1))
+    except Exception as e:
+        logger.warning("連線池預熱失敗", error=e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    啟動時建立 MongoDB 與 LLM 客戶端、建立索引並啟動背景工作，關閉時依相反順序停止
+    """
+    global database, openai_client
+
+    started_at = time.perf_counter()
+    database = db.create_client()
+    app.state.database = database
+    app.state.indexes_ready = False
+    try:
+        await asyncio.to_thread(database.admin.command, "ping")
+        logger.info("成功連接到 MongoDB")
+    except Exception as e:
+        logger.error("無法連接到 MongoDB", error=e)
+        if STARTUP_FAIL_FAST:
+            database.close()
+            raise
+
+    # LLM_PROVIDER=local 時使用離線的模擬提供者；OpenAI SDK 只在這裡載入
+    openai_client = llm_provider.create_llm_client(api_key=openai_api_key)
+
+    app.state.indexes_ready = await _ensure_indexes(database)
+    try:
+        purged = await db.purge_expired_uploads(database)
+        if purged:
+            logger.info("已清除過期的上傳", purged=purged)
+    except Exception as e:
+        logger.error("清除過期的上傳時發生錯誤", error=e)
+
+    scheduler.start_notification_scheduler(database, openai_client)
+    jobs.start_job_workers(database, openai_client)
+    warmup_task = asyncio.create_task(_warmup(database)) if STARTUP_WARMUP else None
+    logger.info("啟動完成", duration_ms=round((time.perf_counter() - started_at) * 1000, 1))
+
+    try:
+        yield
+    finally:
+        if warmup_task is not None:
+            warmup_task.cancel()
+        await scheduler.stop_notification_scheduler()
+        await jobs.stop_job_workers()
+        database.close()
 
 app = FastAPI(
     title="SW-Design API",
     version="1.0.0",
+    lifespan=lifespan,
+    dependencies=[Depends(auth.authenticate)],  # 驗證 access token 並確認 user_id 屬於該使用者
 )
 
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """
+    帶有 X-Profile header（值為 ADMIN_TOKEN）或被取樣的請求以 cProfile 分析，其他請求直接通過
+    """
+    requested = profiling.PROFILE_HEADER in request.headers and auth.is_admin_token(request.headers[profiling.PROFILE_HEADER])
+    if not profiling.should_profile(request.url.path, requested):
+        return await call_next(request)
+    return await profiling.profile_request(request, call_next)
+
+@app.middleware("http")
+async def db_trace_middleware(request: Request, call_next):
+    """
+    開啟 DB_TRACE_ENABLED 時記錄請求發出的所有 MongoDB 指令，並以 X-DB-Trace header 回傳摘要。
+    指令數過多或重複相同查詢形狀（N+1）的請求會記錄警告。
+    """
+    if not dbtrace.DB_TRACE_ENABLED:
+        return await call_next(request)
+
+    token = dbtrace.start_trace()
+    response = None
+    try:
+        response = await call_next(request)
+        return response
+    finally:
+        route = request.scope.get("route")
+        summary = dbtrace.finish_trace(token, request.method, request.url.path, getattr(route, "path", None))
+        # 串流回應在送出 header 後才發出的指令不會計入
+        if response is not None:
+            response.headers[dbtrace.DB_TRACE_HEADER] = dbtrace.format_header(summary)
+
+@app.middleware("http")
+async def correlation_id_middleware(request: Request, call_next):
+    """
+    為每個請求設定 correlation ID（沿用客戶端的 X-Request-ID），同一請求的所有日誌都帶有相同的 request_id
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = logs.request_id_var.set(request_id)
+    started_at = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        logger.info(
+            "請求完成",
+            method=request.method,
+            path=request.url.path,
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - started_at) * 1000, 1)
+        )
+        return response
+    except Exception:
+        logger.exception("請求處理失敗", method=request.method, path=request.url.path)
+        raise
+    finally:
+        logs.request_id_var.reset(token)
+
+def _route_label(scope) -> str:
+    # 以路由樣板（例如 /api/notes/{user_id}/{note_id}）作為 label，避免 ID 造成 label 爆量。
+    # FastAPI 在比對路由時會把 route 寫入 scope，需在 call_next 之後讀取。
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    記錄每個路由的處理時間、進行中的請求數與請求 / 回應大小
+    """
+    method = request.method
+    # 進行中的請求在路由比對前就要計數，因此只以 method 為 label
+    metrics.HTTP_IN_FLIGHT.inc(method)
+    started_at = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response_size = response.headers.get("content-length")
+        if response_size and response_size.isdigit():
+            metrics.HTTP_RESPONSE_SIZE.observe(method, _route_label(request.scope), value=int(response_size))
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec(method)
+        route = _route_label(request.scope)
+        metrics.HTTP_REQUEST_DURATION.observe(method, route, str(status_code), value=time.perf_counter() - started_at)
+        request_size = request.headers.get("content-length")
+        if request_size and request_size.isdigit():
+            metrics.HTTP_REQUEST_SIZE.observe(method, route, value=int(request_size))
+
+@app.exception_handler(security.PasswordHasherBusyError)
+async def password_hasher_busy_handler(request: Request, exc: security.PasswordHasherBusyError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(llm_gateway.LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: llm_gateway.LLMUnavailableError):
+    headers = {}
+    if exc.retry_after is not None:
+        headers["Retry-After"] = str(max(1, int(exc.retry_after + 0.999)))
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"AI 服務暫時無法使用，請稍後再試: {exc}"},
+        headers=headers
+    )
+
 # --- Pydantic 模型定義 ---
 
 # AI 統整請求體
@@ -117,7 +320,7 @@ async def upload_diary_entry_handler(
             if not audio.filename.endswith(".wav"):
                 raise HTTPException(status_code=400, detail="音訊檔案必須是 .wav 格式。")
             audio_content = await audio.read()
-            print(f"接收到音訊檔案: {audio.filename}, 大小: {len(audio_content)} bytes")
+            logger.info("接收到音訊檔案", filename=audio.filename, size=len(audio_content))
         
         # 處理影片檔案
         video_content = None
@@ -125,7 +328,7 @@ async def upload_diary_entry_handler(
             if not video.filename.endswith(".mp4"):
                 raise HTTPException(status_code=400, detail="影片檔案必須是 .mp4 格式。")
             video_content = await video.read()
-            print(f"接收到影片檔案: {video.filename}, 大小: {len(video_content)} bytes")
+            logger.info("接收到影片檔案", filename=video.filename, size=len(video_content))
         
         # 儲存日記條目
         result = await db.save_diary_entry(
@@ -144,7 +347,7 @@ async def upload_diary_entry_handler(
         return result
     
     except Exception as e:
-        print(f"處理日記上傳請求時發生錯誤: {e}")
+        logger.error("處理日記上傳請求時發生錯誤", error=e)
         raise HTTPException(status_code=500, detail=f"處理請求時發生錯誤: {str(e)}")
 
 
@@ -175,12 +378,7 @@ async def upload_diary_entry(
     # 這裡可以加入處理接收到的資料和檔案的邏輯
     # 例如：儲存檔案、驗證檔案類型、更新資料庫等
 
-    print(f"接收到日記上傳請求:")
-    print(f"  user_id: {user_id}")
-    print(f"  note_id: {note_id}")
-    print(f"  line_id: {line_id}")
-    print(f"  type: {type}")
-    print(f"  text: {text}")
+    logger.info("接收到日記上傳請求", user_id=user_id, note_id=note_id, line_id=line_id, type=type, text=text)
     
     if line_id == 0:
         db.clear_diary_collection(database, user_id, note_id)
@@ -195,7 +393,7 @@ async def upload_diary_entry(
             raise HTTPException(status_code=400, detail="音訊檔案必須是 .wav 格式。")
         # 模擬處理音訊檔案
         audio_content = await audio.read()
-        print(f"  接收到音訊檔案: {audio.filename}, 大小: {len(audio_content)} bytes, 內容類型: {audio.content_type}")
+        logger.info("接收到音訊檔案", filename=audio.filename, size=len(audio_content), content_type=audio.content_type)
         
     if image:
         # 檢查檔案類型 (範例)
@@ -203,7 +401,7 @@ async def upload_diary_entry(
             raise HTTPException(status_code=400, detail="音訊檔案必須是 .jpg 格式。")
         # 模擬處理音訊檔案
         image_content = await image.read()
-        print(f"  接收到音訊檔案: {image.filename}, 大小: {len(image_content)} bytes, 內容類型: {image.content_type}")
+        logger.info("接收到圖片檔案", filename=image.filename, size=len(image_content), content_type=image.content_type)
 
     if video:
         # 檢查檔案類型 (範例)
@@ -211,7 +409,7 @@ async def upload_diary_entry(
             raise HTTPException(status_code=400, detail="影片檔案必須是 .mp4 格式。")
         # 模擬處理影片檔案
         video_content = await video.read()
-        print(f"  接收到影片檔案: {video.filename}, 大小: {len(video_content)} bytes, 內容類型: {video.content_type}")
+        logger.info("接收到影片檔案", filename=video.filename, size=len(video_content), content_type=video.content_type)
     
     await db.save_diary_entry(
             database,
@@ -227,9 +425,165 @@ async def upload_diary_entry(
             video,
             video_content
         )
+    
+    # 筆記內容有變動，通知交由背景排程重新生成
+    await db.mark_notification_stale(database, user_id)
+    
+    # hashtags 與行程提取交由背景工作處理，連續上傳同一篇筆記只會執行一次
+    job_id = await jobs.enqueue_enrichment(database, user_id, note_id)
+    
+    response = {"job_id": job_id}
+    
+    # 有音訊時在背景直接從 GridFS 轉錄，客戶端不需要再上傳一次
+    if audio_content and jobs.AUTO_TRANSCRIBE_AUDIO:
+        response["transcribe_job_id"] = await jobs.enqueue_transcription(database, user_id, note_id)
+
+    return response
+
+def _upload_expires_at() -> datetime.datetime:
+    return datetime.datetime.now() + datetime.timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+
+async def _get_active_upload(request: Request, upload_id: str) -> dict:
+    session = await db.get_upload_session(database, upload_id)
+    if session is None or (session["status"] == "active" and session["expires_at"] < datetime.datetime.now()):
+        raise HTTPException(status_code=404, detail=f"找不到上傳工作階段 {upload_id}")
+    auth.check_user(request, session["user_id"])
+    return session
+
+def _serialize_upload(session: dict) -> dict:
+    return {
+        "upload_id": str(session["_id"]),
+        "file_id": str(session["file_id"]),
+        "status": session["status"],
+        "offset": session["committed_offset"],
+        "total_size": session["total_size"],
+        "chunk_size": session["chunk_size"],
+    }
+
+@app.post("/api/uploads", status_code=201, tags=["上傳日記"])
+async def create_upload(
+    user_id: str = Form(...),
+    note_id: str = Form(...),
+    line_id: int = Form(...),
+    type: str = Form(...),
+    kind: str = Form(...),
+    filename: str = Form(...),
+    total_size: int = Form(...),
+    content_type: Optional[str] = Form(None),
+):
+    """
+    建立可續傳的大檔案上傳（音訊或影片）。
+    流程：建立工作階段 → 以 PUT /api/uploads/{upload_id}?offset= 依序上傳資料 → finalize。
+    連線中斷後以 GET /api/uploads/{upload_id} 取得已提交的位置，從該位置繼續上傳。
+    
+    - **kind**: "audio"（.wav）或 "video"（.mp4）
+    - **total_size**: 檔案總大小 (bytes)
+    """
+    if kind not in UPLOAD_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="kind 必須是 audio 或 video")
+    if not filename.endswith(UPLOAD_EXTENSIONS[kind]):
+        raise HTTPException(status_code=400, detail=f"{kind} 檔案必須是 {UPLOAD_EXTENSIONS[kind]} 格式。")
+    if total_size <= 0 or total_size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=400, detail=f"檔案大小必須介於 1 到 {UPLOAD_MAX_BYTES} bytes")
+    
+    logger.info("建立續傳上傳", user_id=user_id, note_id=note_id, line_id=line_id, filename=filename, size=total_size)
+    
+    session = await db.create_upload_session(
+        database,
+        user_id,
+        note_id,
+        line_id,
+        type,
+        kind,
+        filename,
+        content_type or ("audio/wav" if kind == "audio" else "video/mp4"),
+        total_size,
+        UPLOAD_CHUNK_SIZE,
+        _upload_expires_at()
+    )
+    return _serialize_upload(session)
+
+@app.get("/api/uploads/{upload_id}", tags=["上傳日記"])
+async def get_upload_status(upload_id: str, request: Request):
+    """
+    取得上傳進度，offset 為伺服器已提交的位置，續傳時從這裡開始
+    """
+    return _serialize_upload(await _get_active_upload(request, upload_id))
+
+@app.put("/api/uploads/{upload_id}", tags=["上傳日記"])
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """
+    從 offset 開始上傳一段資料，request body 為原始的檔案內容。
+    資料以 chunk 為單位邊接收邊寫入 GridFS，連線中斷前已寫入的部分都會保留。
+    
+    - **offset**: 這段資料在檔案中的起始位置，必須等於目前已提交的位置，否則回傳 409 與正確的 offset
+    """
+    session = await _get_active_upload(request, upload_id)
+    if session["status"] != "active":
+        raise HTTPException(status_code=409, detail={"message": "上傳已完成", "offset": session["committed_offset"]})
+    if offset != session["committed_offset"]:
+        raise HTTPException(status_code=409, detail={"message": "offset 與已提交的位置不符", "offset": session["committed_offset"]})
+    
+    buffer = bytearray()
+    writer_id = uuid.uuid4().hex
+    
+    async def _flush():
+        if session["committed_offset"] + len(buffer) > session["total_size"]:
+            raise HTTPException(status_code=400, detail="上傳的資料超過宣告的檔案大小")
+        lease_until = datetime.datetime.now() + datetime.timedelta(seconds=UPLOAD_WRITER_LEASE_SECONDS)
+        new_offset = await db.append_upload_data(database, session, bytes(buffer), _upload_expires_at(), writer_id, lease_until)
+        if new_offset is None:
+            raise HTTPException(status_code=409, detail={"message": "同一個上傳有其他請求正在寫入", "offset": session["committed_offset"]})
+        session["committed_offset"] = new_offset
+        buffer.clear()
+    
+    try:
+        async for data in request.stream():
+            buffer.extend(data)
+            if len(buffer) >= session["chunk_size"]:
+                await _flush()
+        if buffer:
+            await _flush()
+    finally:
+        await db.release_upload_writer(database, session, writer_id)
+    
+    return _serialize_upload(session)
+
+@app.post("/api/uploads/{upload_id}/finalize", tags=["上傳日記"])
+async def finalize_upload(upload_id: str, request: Request):
+    """
+    完成上傳，將檔案連結到建立工作階段時指定的 (note_id, line_id)，並排入背景工作
+    """
+    session = await _get_active_upload(request, upload_id)
+    if session["status"] == "active" and session["committed_offset"] != session["total_size"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "檔案尚未上傳完成", "offset": session["committed_offset"]}
+        )
+    
+    already_completed = session["status"] == "completed"
+    result = await db.finalize_upload_session(database, session)
+    if already_completed:
+        return result
+    
+    user_id, note_id = session["user_id"], session["note_id"]
+    await db.mark_notification_stale(database, user_id)
+    result["job_id"] = await jobs.enqueue_enrichment(database, user_id, note_id)
+    if session["kind"] == "audio" and jobs.AUTO_TRANSCRIBE_AUDIO:
+        result["transcribe_job_id"] = await jobs.enqueue_transcription(database, user_id, note_id)
+    
+    return result
 
-    # 根據您的需求，回應一個空的 JSON 物件
-    return {}
+@app.delete("/api/uploads/{upload_id}", tags=["上傳日記"])
+async def abort_upload(upload_id: str, request: Request):
+    """
+    取消尚未完成的上傳並刪除已上傳的資料
+    """
+    session = await _get_active_upload(request, upload_id)
+    if session["status"] != "active":
+        raise HTTPException(status_code=409, detail="上傳已完成，無法取消")
+    await db.delete_upload_session(database, session)
+    return {"message": "上傳已取消"}
 
 @app.post("/api/create", status_code=200, tags=["新增日記"])
 async def create_diary(
@@ -242,9 +596,10 @@ async def create_diary(
     - **user_id**: 使用者的唯一識別碼。
     - **note_id**: 筆記的唯一識別碼。
     """
-    print(f"接收到創建日記請求: user_id={user_id}, note_id={note_id}")
+    logger.info("接收到創建日記請求", user_id=user_id, note_id=note_id)
     
     await db.add_note_id_to_note_list(database, user_id, note_id)
+    await db.mark_notification_stale(database, user_id)
     
     # 返回成功回應
     return JSONResponse(content={"message": "日記創建成功"})
@@ -260,16 +615,18 @@ async def delete_diary(
     - **user_id**: 使用者的唯一識別碼。
     - **note_id**: 筆記的唯一識別碼。
     """
-    print(f"接收到刪除日記請求: user_id={user_id}, note_id={note_id}")
+    logger.info("接收到刪除日記請求", user_id=user_id, note_id=note_id)
     
     # 刪除指定的日記條目
     try:
         await db.delete_note_from_note_list(database, user_id, note_id)
+        await db.delete_note_events(database, user_id, note_id)
+        await db.mark_notification_stale(database, user_id)
     
         # 返回成功回應
         return JSONResponse(content={"message": "日記刪除成功"})
     except Exception as e:
-        print(f"刪除日記時發生錯誤: {e}")
+        logger.error("刪除日記時發生錯誤", error=e)
         raise HTTPException(status_code=500, detail=f"刪除日記時發生錯誤: {str(e)}")
 
 @app.get("/api/note_list/{user_id}", tags=["獲得筆記列表"])
@@ -290,13 +647,15 @@ async def get_user_note_list_simple(user_id: str):
         return note_ids  # 直接回傳陣列
         
     except Exception as e:
-        print(f"API 處理時發生錯誤: {e}")
+        logger.error("API 處理時發生錯誤", error=e)
         raise HTTPException(status_code=500, detail=f"獲取筆記列表時發生錯誤: {str(e)}")
 
 @app.get("/api/notes/{user_id}/{note_id}", tags=["獲取筆記內容"])
 async def get_note_content(
     user_id: str,
     note_id: str,
+    audio_format: str = "wav",
+    image_size: str = "original",
 ):
     """
     獲取指定筆記的所有內容，包含文字、音訊和影片。
@@ -304,15 +663,22 @@ async def get_note_content(
     參數:
     - user_id: 使用者 ID
     - note_id: 筆記 ID
+    - audio_format: "wav"（預設）回傳 WAV 音訊；"stored" 回傳儲存的精簡格式，由客戶端自行解碼
+    - image_size: "original"（預設）、"thumb" 或 "screen"，列表頁使用 thumb 可大幅減少傳輸量
     
     回傳:
     - 筆記的所有內容，按 line_id 排序
     """
     
-    print(f"接收到筆記內容請求: user_id={user_id}, note_id={note_id}")
+    logger.info("接收到筆記內容請求", user_id=user_id, note_id=note_id)
     
     # 獲取筆記內容
-    content = await db.get_content_from_note_id(database, user_id, note_id)
+    if audio_format not in ("wav", "stored"):
+        raise HTTPException(status_code=400, detail="audio_format 必須是 wav 或 stored")
+    if image_size not in images.IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"image_size 必須是 {', '.join(images.IMAGE_SIZES)} 其中之一")
+    
+    content = await db.get_content_from_note_id(database, user_id, note_id, audio_format, image_size)
     
     if "error" in content and content["error"]:
         raise HTTPException(status_code=500, detail=content["message"])
@@ -320,6 +686,58 @@ async def get_note_content(
     # 使用 json_util 處理 MongoDB 特定類型
     return JSONResponse(content=json.loads(json_util.dumps(content)))
 
+@app.get("/api/audio/{user_id}/{note_id}/{file_id}", tags=["獲取筆記內容"])
+async def get_stored_audio(user_id: str, note_id: str, file_id: str, format: str = "wav"):
+    """
+    下載單一音訊檔案。
+    
+    - **format**: "wav"（預設）將精簡格式還原為 WAV；"stored" 直接回傳儲存的內容
+    """
+    import audio  # 依賴 numpy，使用時才載入
+    try:
+        content, info = await db.get_gridfs_file(database, user_id, note_id, file_id)
+    except gridfs.errors.NoFile:
+        raise HTTPException(status_code=404, detail=f"找不到音訊檔案 {file_id}")
+    except bson.errors.InvalidId:
+        raise HTTPException(status_code=400, detail=f"無效的檔案 ID: {file_id}")
+    
+    content_type = info["content_type"] or "application/octet-stream"
+    if format == "wav" and audio.is_compact(content):
+        content = await asyncio.to_thread(audio.decode_compact, content)
+        content_type = info["metadata"].get("content_type") or "audio/wav"
+    
+    return Response(content=content, media_type=content_type)
+
+@app.get("/api/image/{user_id}/{note_id}/{file_id}", tags=["獲取筆記內容"])
+async def get_stored_image(user_id: str, note_id: str, file_id: str, size: str = "original"):
+    """
+    下載單一圖片檔案。
+    
+    - **size**: "original"（預設）、"thumb" 或 "screen"；舊資料沒有衍生版本時回傳原圖
+    """
+    if size not in images.IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"size 必須是 {', '.join(images.IMAGE_SIZES)} 其中之一")
+    
+    try:
+        # 先只讀取原圖的 metadata 找出衍生版本，只下載實際要回傳的檔案
+        target_id = file_id
+        if size != "original":
+            metadata = await db.get_gridfs_file_metadata(database, user_id, note_id, file_id)
+            if metadata is None:
+                raise gridfs.errors.NoFile(file_id)
+            target_id = metadata.get("derivatives", {}).get(size) or file_id
+        content, info = await db.get_gridfs_file(database, user_id, note_id, target_id)
+    except gridfs.errors.NoFile:
+        raise HTTPException(status_code=404, detail=f"找不到圖片檔案 {file_id}")
+    except bson.errors.InvalidId:
+        raise HTTPException(status_code=400, detail=f"無效的檔案 ID: {file_id}")
+    
+    return Response(
+        content=content,
+        media_type=info["content_type"] or "image/jpeg",
+        headers={"Cache-Control": "private, max-age=86400"},
+    )
+
 @app.get("/api/notes/{user_id}/{note_id}/hashtags", response_model=list[str], tags=["獲取 hashtags"])
 async def get_note_hashtags_api(
     user_id: str,
@@ -354,7 +772,7 @@ async def get_note_hashtags_api(
         # 重新拋出 HTTP 異常
         raise
     except Exception as e:
-        print(f"API 處理時發生錯誤: {e}")
+        logger.error("API 處理時發生錯誤", error=e)
         raise HTTPException(
             status_code=500, 
             detail=f"獲取標籤時發生錯誤: {str(e)}"
@@ -373,9 +791,45 @@ async def get_summary(
     # 例如：
     summary_content = await mistral.generate_summary_from_note(database, user_id, note_id, custom_prompt, openai_client)
     # return {"summary": summary_content}
-    print(f"接收到摘要請求: note_id={note_id}, custom_prompt={custom_prompt}")
+    logger.info("接收到摘要請求", user_id=user_id, note_id=note_id, custom_prompt=custom_prompt)
     return {"summary": f"{summary_content}"}
 
+@app.post("/api/summary/stream", tags=["AI 功能"])
+async def stream_summary(
+    user_id: str = Form(...),
+    note_id: str = Form(...),
+    custom_prompt: Optional[str] = Form(None)
+):
+    """
+    以 Server-Sent Events 串流回傳摘要，模型產生文字時即時送出。
+    
+    - 每個片段以 `data: {"token": "..."}` 事件送出
+    - 完成時送出 `event: done`，data 為完整摘要
+    - 發生錯誤時送出 `event: error`
+    """
+    logger.info("接收到串流摘要請求", user_id=user_id, note_id=note_id, custom_prompt=custom_prompt)
+    
+    async def event_generator():
+        parts = []
+        try:
+            async for token in mistral.stream_summary_from_note(database, user_id, note_id, custom_prompt, openai_client):
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+            summary = "".join(parts).strip()
+            yield f"event: done\ndata: {json.dumps({'summary': summary}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error("串流摘要時發生錯誤", error=e)
+            yield f"event: error\ndata: {json.dumps({'detail': '無法生成摘要，請稍後再試。'}, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 避免反向代理緩衝整個回應
+        }
+    )
+
 @app.post("/api/gen_hashtag", tags=["生成 hashtags"])
 async def get_summary(
     user_id: str = Form(...),
@@ -388,7 +842,7 @@ async def get_summary(
     # 例如：
     hashtags = await mistral.generate_hashtag_from_note(database, user_id, note_id, openai_client)
     # return {"summary": summary_content}
-    print(f"接收到 hashtags 請求: note_id={note_id}, hashtags={hashtags}")
+    logger.info("接收到 hashtags 請求", user_id=user_id, note_id=note_id, hashtags=hashtags)
     return {"hashtags": f"{hashtags}"}
 
 # GPU_SERVER_URL = "http://140.114.91.158:8760/transcribe"
@@ -405,7 +859,7 @@ async def get_summary(
 #         raise HTTPException(status_code=400, detail="僅支援 .wav、.mp3 或 .m4a 格式的音檔。")
 
 #     try:
-#         print(f"接收到音檔: {audio.filename}, 內容類型: {audio.content_type}, 語言: {language}")
+#         logger.info("接收到轉錄音檔", filename=audio.filename, content_type=audio.content_type, language=language)
         
 #         # 讀取上傳的音訊檔案內容
 #         content = await audio.read()
@@ -466,6 +920,7 @@ async def transcribe_audio(audio: UploadFile = File(...), language: str = Form("
     接收音檔並使用 OpenAI Whisper API 將其轉換為文字。
     
     - **audio**: 要轉錄的音訊檔案 (支援多種格式：mp3, mp4, mpeg, mpga, m4a, wav, webm)
+      長的 .wav 會在伺服器端依靜音切段併發轉錄；其他格式仍受 25MB 限制
     - **language**: 音訊的語言代碼 (預設為中文 'zh')
     """
     
@@ -479,53 +934,28 @@ async def transcribe_audio(audio: UploadFile = File(...), language: str = Form("
         )
 
     try:
-        print(f"接收到音檔: {audio.filename}, 內容類型: {audio.content_type}, 語言: {language}")
+        logger.info("接收到轉錄音檔", filename=audio.filename, content_type=audio.content_type, language=language)
         
         # 讀取上傳的音訊檔案內容
         content = await audio.read()
         
-        # 檢查檔案大小 (OpenAI 限制 25MB)
-        if len(content) > 25 * 1024 * 1024:  # 25MB
-            raise HTTPException(
-                status_code=400,
-                detail="音檔大小不能超過 25MB"
-            )
-        
-        print(f"音檔大小: {len(content)} bytes")
+        logger.debug("轉錄音檔大小", size=len(content))
         
-        # 使用 OpenAI Whisper API 進行轉錄
-        audio_file = io.BytesIO(content)
-        audio_file.name = audio.filename  # 設定檔名，OpenAI 需要這個來判斷格式
+        # 長的 WAV 會在靜音處切段併發轉錄，不受 25MB 限制
+        transcribed_text = await transcription.transcribe_audio_bytes(openai_client, content, audio.filename, language, database)
         
-        # 語言代碼轉換 (如果需要)
-        language_mapping = {
-            "zh-TW": "zh-TW",
-            "en": "en",
-            "ja": "ja",
-            "ko": "ko",
-            # 可以根據需要添加更多語言映射
-        }
-        
-        whisper_language = language_mapping.get(language, language)
-        
-        # 呼叫 OpenAI Whisper API
-        response = openai_client.audio.transcriptions.create(
-            model="gpt-4o-transcribe",
-            file=audio_file,
-            language=whisper_language,  # 指定語言可以提高準確性
-            response_format="text",     # 直接返回文字，也可以選擇 "json", "srt", "verbose_json", "vtt"
-            temperature=0.2,            # 降低溫度以獲得更一致的結果
-        )
-        
-        # OpenAI 直接返回文字內容
-        transcribed_text = response.strip() if isinstance(response, str) else response
-        
-        print(f"成功獲取轉錄結果: {transcribed_text[:50]}...")
+        logger.info("成功獲取轉錄結果", text=transcribed_text)
         
         return {"text": transcribed_text}
         
+    except HTTPException:
+        raise
+    except llm_gateway.LLMUnavailableError:
+        raise
+    except transcription.AudioTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"使用 OpenAI 轉錄音訊時發生錯誤: {str(e)}")
+        logger.error("使用 OpenAI 轉錄音訊時發生錯誤", error=e)
         
         # 根據不同的錯誤類型提供更具體的錯誤訊息
         if "rate limit" in str(e).lower():
@@ -549,6 +979,35 @@ async def transcribe_audio(audio: UploadFile = File(...), language: str = Form("
                 detail=f"語音轉文字處理失敗: {str(e)}"
             )
 
+@app.post("/api/audio/transcribe_stored", tags=["語音轉文字"])
+async def transcribe_stored_audio(
+    user_id: str = Form(...),
+    note_id: str = Form(...),
+    file_id: str = Form(...),
+    language: str = Form("zh-TW")
+):
+    """
+    直接轉錄已儲存在 GridFS 的音訊檔案，轉錄結果會寫回該行的文字並可被搜尋。
+    
+    - **file_id**: 上傳音訊時產生的檔案 ID (audio_file_id)
+    """
+    logger.info("接收到已儲存音訊的轉錄請求", user_id=user_id, note_id=note_id, file_id=file_id)
+    
+    try:
+        return await transcription.transcribe_stored_audio(openai_client, database, user_id, note_id, file_id, language)
+    
+    except llm_gateway.LLMUnavailableError:
+        raise
+    except gridfs.errors.NoFile:
+        raise HTTPException(status_code=404, detail=f"找不到音訊檔案 {file_id}")
+    except bson.errors.InvalidId:
+        raise HTTPException(status_code=400, detail=f"無效的檔案 ID: {file_id}")
+    except transcription.AudioTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("轉錄已儲存音訊時發生錯誤", error=e)
+        raise HTTPException(status_code=500, detail=f"語音轉文字處理失敗: {str(e)}")
+
 @app.get("/api/search/{user_id}", response_model=SearchResponse, tags=["搜尋功能"])
 async def search_notes(user_id: str, query: str):
     """
@@ -578,7 +1037,7 @@ async def search_notes(user_id: str, query: str):
         )
     
     except Exception as e:
-        print(f"搜尋 API 處理時發生錯誤: {e}")
+        logger.error("搜尋 API 處理時發生錯誤", error=e)
         raise HTTPException(status_code=500, detail=f"搜尋時發生錯誤: {str(e)}")
 
 
@@ -599,17 +1058,208 @@ async def search_notes(user_id: str, query: str):
 async def check_notifications(user_id: str):
     """
     進行情緒偵測並決定是否需要通知用戶。
+    
+    優先回傳背景排程預先生成的通知；尚未生成過時才即時生成並儲存。
     """
-    notify = await mistral.generate_notify(database, user_id, openai_client)
-    print(f"接收到通知檢查請求: {notify}")
+    stored = await db.get_stored_notification(database, user_id)
+    if stored is not None:
+        logger.info("接收到通知檢查請求，使用預先生成的通知", user_id=user_id)
+        return stored["message"]
+    
+    try:
+        notify = await scheduler.refresh_user_notification(database, user_id, openai_client)
+    except llm_gateway.LLMUnavailableError:
+        raise
+    except Exception as e:
+        # 預設訊息不儲存，下次請求或排程會重新生成
+        logger.error("即時生成通知時發生錯誤，回傳預設訊息", user_id=user_id, error=e)
+        return mistral.DEFAULT_NOTIFICATION
+    logger.info("接收到通知檢查請求，即時生成通知", user_id=user_id)
     return notify
 
 @app.get("/api/link/{user_id}/{note_id}", tags=["連結功能"])
 async def get_note_link(user_id: str, note_id: str):
     result = await mistral.get_event_link_from_note(database, user_id, note_id, openai_client)
-    print(result)
+    logger.debug("行程提取結果", user_id=user_id, note_id=note_id, events=result)
     return result
 
+@app.get("/api/events/{user_id}", tags=["連結功能"])
+async def get_events_in_range(user_id: str, start: str, end: str):
+    """
+    取得日期區間內所有已提取的行程，供行事曆顯示。
+    
+    - **start**: 起始日期 (YYYYMMDD，包含)
+    - **end**: 結束日期 (YYYYMMDD，包含)
+    
+    只會回傳已透過 /api/link 提取過的日記行程。
+    """
+    for value in (start, end):
+        if len(value) != 8 or not value.isdigit():
+            raise HTTPException(status_code=400, detail="日期格式必須為 YYYYMMDD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="起始日期不能晚於結束日期")
+    
+    events = await db.get_events_in_range(database, user_id, start, end)
+    return {
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "events": events,
+        "total_events": len(events)
+    }
+
+@app.get("/api/jobs/{job_id}", tags=["背景工作"])
+async def get_job_status(job_id: str, request: Request):
+    """
+    查詢背景工作的狀態。
+    
+    - **status**: pending / running / done / failed
+    """
+    job = await db.get_job(database, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"找不到工作 {job_id}")
+    auth.check_user(request, job["user_id"])
+    
+    return jobs.serialize_job(job)
+
+@app.get("/api/admin/llm_gateway", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def get_llm_gateway_stats():
+    """
+    外部 LLM 閘道的即時統計：排隊數、進行中呼叫、限流與重試次數、斷路器狀態。
+    """
+    return llm_gateway.get_stats()
+
+@app.get("/api/admin/transcription", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def get_transcription_stats():
+    """
+    語音轉文字的統計：快取命中次數、前處理前後的位元組與秒數。
+    """
+    return transcription.get_stats()
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """
+    存活檢查：只確認程序可以處理請求，不檢查外部服務
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz(request: Request):
+    """
+    就緒檢查：MongoDB 可連線且共用集合的索引都已建立時返回 200，否則返回 503
+    """
+    client = request.app.state.database
+    checks = {}
+    try:
+        await asyncio.wait_for(asyncio.to_thread(client.admin.command, "ping"), READINESS_TIMEOUT_SECONDS)
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = f"error: {type(e).__name__}"
+
+    if checks["mongo"] == "ok":
+        # 啟動時建立索引失敗的話，在這裡重試
+        if not request.app.state.indexes_ready:
+            request.app.state.indexes_ready = await _ensure_indexes(client)
+        try:
+            missing = await asyncio.wait_for(asyncio.to_thread(db.missing_indexes, client), READINESS_TIMEOUT_SECONDS)
+            checks["indexes"] = "ok" if not missing else {"missing": missing}
+        except Exception as e:
+            checks["indexes"] = f"error: {type(e).__name__}"
+
+    ready = all(value == "ok" for value in checks.values()) and "indexes" in checks
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Prometheus 文字格式的指標
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/profiles", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def list_profiles():
+    """
+    列出保留中的單一請求效能分析結果與目前的取樣設定
+    """
+    return {"settings": profiling.get_settings(), "profiles": await asyncio.to_thread(profiling.list_profiles)}
+
+@app.post("/api/admin/profiles/settings", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def update_profile_settings(
+    sample_rate: Optional[float] = Form(None),
+    route_prefix: Optional[str] = Form(None),
+):
+    """
+    調整效能分析的取樣設定。
+    
+    - **sample_rate**: 0–1，符合 route_prefix 的請求被分析的比例，0 表示只分析帶 X-Profile header 的請求
+    - **route_prefix**: 只取樣此路徑前綴的請求，例如 /api/notes
+    """
+    return profiling.update_settings(sample_rate, route_prefix)
+
+@app.get("/api/admin/profiles/{profile_id}", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def download_profile(profile_id: str, format: str = "prof"):
+    """
+    下載效能分析結果。
+    
+    - **format**: "prof"（預設）下載 pstats 檔案，可用 snakeviz 等工具開啟；"text" 回傳依累計時間排序的報表
+    """
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"找不到效能分析結果 {profile_id}")
+    
+    if format == "text":
+        return Response(content=await asyncio.to_thread(profiling.render_text, path), media_type="text/plain; charset=utf-8")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/api/admin/db_traces", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def get_db_traces():
+    """
+    取得最近被標記的請求與其 MongoDB 指令列表（需開啟 DB_TRACE_ENABLED）
+    """
+    return {
+        "enabled": dbtrace.DB_TRACE_ENABLED,
+        "max_commands": dbtrace.DB_TRACE_MAX_COMMANDS,
+        "repeat_threshold": dbtrace.DB_TRACE_REPEAT_THRESHOLD,
+        "flagged": dbtrace.get_flagged(),
+    }
+
+@app.get("/api/admin/slow_queries", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def get_slow_queries(limit: int = 20):
+    """
+    依總時間列出最慢的 MongoDB 查詢形狀，scan 為 explain 的結果（COLLSCAN 表示缺少索引）
+    
+    - **limit**: 返回的查詢形狀數量
+    """
+    return {
+        "threshold_ms": slowquery.SLOW_QUERY_THRESHOLD_MS,
+        "queries": slowquery.top_offenders(limit),
+    }
+
+@app.delete("/api/admin/slow_queries", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def reset_slow_queries():
+    """
+    清除累計的慢查詢統計，例如在新增索引後重新觀察
+    """
+    slowquery.reset()
+    return {"success": True}
+
+@app.get("/api/admin/logging", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def get_logging_stats():
+    """
+    取得日誌佇列的狀態，dropped 為佇列滿時丟棄的紀錄數
+    """
+    return logs.get_stats()
+
+@app.get("/api/admin/password_hashing", tags=["系統狀態"], dependencies=[Depends(auth.require_admin)])
+async def get_password_hashing_stats():
+    """
+    取得密碼雜湊的排隊時間與執行統計
+    """
+    return security.get_stats()
+
 @app.post("/api/register", status_code=status.HTTP_201_CREATED, tags=["登入功能"])
 async def register_user(
     username: str = Form(...),
@@ -626,8 +1276,8 @@ async def register_user(
             detail="Username already registered"
         )   
     
-    # 雜湊密碼
-    hashed_password = security.get_password_hash(password)
+    # 雜湊密碼（在專用執行緒池中執行，不阻塞其他請求）
+    hashed_password = await security.hash_password(password)
     
     # 建立使用者資料
     user_data = dict()
@@ -644,7 +1294,7 @@ async def login_user(
     username: str = Form(...),
     password: str = Form(...),
 ):
-    print(f"接收到登入請求: username={username}, password={password}")
+    logger.info("接收到登入請求", username=username)
     
     db = database['auth_db']
     users_collection = db['users']
@@ -658,16 +1308,74 @@ async def login_user(
             detail="Incorrect username or password"
         )
         
-    # 驗證密碼
-    if not security.verify_password(password, db_user["hashed_password"]):
+    # 驗證密碼（在專用執行緒池中執行，不阻塞其他請求）
+    verified, new_hash = await security.verify_and_update(password, db_user["hashed_password"])
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Incorrect username or password"
         )
+    
+    # bcrypt cost 調整後，以新的 cost 更新儲存的雜湊
+    if new_hash is not None:
+        users_collection.update_one(
+            {"_id": db_user["_id"], "hashed_password": db_user["hashed_password"]},
+            {"$set": {"hashed_password": new_hash}}
+        )
         
-    # 在這個簡單範例中，我們只返回成功訊息
-    # 在實際應用中，這裡會生成 JWT (JSON Web Token)[2]
-    return {"message": "Login successful", "username": username}
+    # 發出 access token 與 refresh token，之後的請求以 Authorization: Bearer 驗證，不需再查詢資料庫
+    return {
+        "message": "Login successful",
+        "username": username,
+        **auth.issue_token_pair(username, db_user.get("token_version", 0))
+    }
+
+@app.post("/api/token/refresh", tags=["登入功能"])
+async def refresh_token(refresh_token: str = Form(...)):
+    """
+    以 refresh token 換發新的 access token 與 refresh token，舊的 refresh token 會被撤銷
+    """
+    try:
+        claims = await auth.verify_request_token(database, refresh_token, auth.REFRESH)
+    except auth.InvalidTokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    auth.revoke(claims)
+    return auth.issue_token_pair(claims["sub"], claims.get("ver", 0))
+
+@app.post("/api/logout", tags=["登入功能"])
+async def logout_user(
+    request: Request,
+    refresh_token: Optional[str] = Form(None),
+    all_devices: bool = Form(False),
+):
+    """
+    登出：撤銷目前的 access token 與提供的 refresh token。
+    
+    - **all_devices**: 為 true 時作廢該使用者所有已發出的 token
+    """
+    claims = request.state.auth
+    if claims is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="需要登入", headers={"WWW-Authenticate": "Bearer"})
+    
+    auth.revoke(claims)
+    if refresh_token:
+        try:
+            refresh_claims = auth.decode_token(refresh_token, auth.REFRESH)
+            if refresh_claims["sub"] == claims["sub"]:
+                auth.revoke(refresh_claims)
+        except auth.InvalidTokenError:
+            pass
+    
+    if all_devices:
+        await db.bump_token_version(database, claims["sub"])
+        auth.invalidate_user(claims["sub"])
+    
+    return {"message": "Logout successful"}
 
 # 若要在本地運行此應用程式，可以使用 uvicorn：
 # uvicorn main:app --reload
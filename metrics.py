@@ -0,0 +1,236 @@
+import bisect
+import threading
+
+from pymongo import monitoring
+
+# Prometheus 文字格式的輕量指標。記錄只做 dict 查找與加法，可常駐開啟。
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def _samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+        self.collect = collect  # 輸出時才計算的值：返回 {labels: value}
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self.lock:
+            self.values[labels] = value
+
+    def _samples(self):
+        if self.collect is not None:
+            items = list(self.collect().items())
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [各區間計數..., +Inf 計數, 總和]
+
+    def observe(self, *labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def _samples(self):
+        with self.lock:
+            items = [(labels, list(state)) for labels, state in self.values.items()]
+
+        lines = []
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """
+    輸出所有指標的 Prometheus 文字格式
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP ---
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP 請求處理時間", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "處理中的 HTTP 請求數", ("method",)
+)
+HTTP_REQUEST_SIZE = Histogram(
+    "http_request_size_bytes", "HTTP 請求內容大小", ("method", "route"), buckets=SIZE_BUCKETS
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "HTTP 回應內容大小（不含串流回應）", ("method", "route"), buckets=SIZE_BUCKETS
+)
+
+# --- MongoDB ---
+
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "MongoDB 指令執行時間", ("command", "collection_kind", "outcome"), buckets=MONGO_BUCKETS
+)
+GRIDFS_BYTES = Counter(
+    "gridfs_bytes_total", "GridFS 讀寫的位元組數", ("direction", "kind")
+)
+
+# --- LLM ---
+
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds", "LLM 與語音轉文字呼叫時間（不含排隊）", ("operation", "model", "outcome")
+)
+LLM_STREAM_DURATION = Histogram(
+    "llm_stream_duration_seconds", "串流回應從送出請求到最後一個片段的時間", ("operation", "model")
+)
+LLM_TOKENS = Histogram(
+    "llm_tokens", "每次 LLM 呼叫的 token 數", ("operation", "model", "type"), buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS_TOTAL = Counter(
+    "llm_tokens_total", "LLM 呼叫累計的 token 數", ("operation", "model", "type")
+)
+
+
+def observe_llm_usage(operation: str, model: str, usage):
+    """
+    記錄回應中的 token 用量，沒有 usage 的回應（串流、轉錄）不記錄
+    """
+    for token_type in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, token_type, None)
+        if isinstance(count, int):
+            kind = token_type.replace("_tokens", "")
+            LLM_TOKENS.observe(operation, model, kind, value=count)
+            LLM_TOKENS_TOTAL.inc(operation, model, kind, amount=count)
+
+
+# 共用集合的名稱，其他集合依名稱判斷類型，避免以使用者或筆記 ID 作為 label
+_SHARED_COLLECTIONS = {
+    "note_list", "summary_cache", "events", "event_sources", "notifications",
+    "jobs", "transcripts", "upload_sessions", "users",
+}
+
+
+def collection_kind(collection) -> str:
+    """
+    將集合名稱歸類，讓 label 的數量固定
+    """
+    if not isinstance(collection, str):
+        return "none"
+    if collection in _SHARED_COLLECTIONS:
+        return collection
+    if collection.endswith(".chunks"):
+        return "gridfs_chunks"
+    if collection.endswith(".files"):
+        return "gridfs_files"
+    if collection.startswith("$") or collection.startswith("system."):
+        return "system"
+    return "note"
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    記錄每個 MongoDB 指令的執行時間，以指令名稱與集合類型為 label
+    """
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection_kind(collection)
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            kind = self._pending.pop((event.connection_id, event.request_id), "none")
+        MONGO_COMMAND_DURATION.observe(event.command_name, kind, outcome, value=event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
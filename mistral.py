@@ -1,24 +1,44 @@
 import os
-from mistralai import Mistral
-from openai import OpenAI
+import asyncio
+import hashlib
 import time
-import requests
 import db
 import json
+import prompt_budget
+import llm_gateway
+import logs
+import metrics
 
-async def generate_summary_from_note(client, user_id: str, note_id: str, custom_prompt: str, openai_client) -> str:
+logger = logs.get_logger(__name__)
+
+# 未指定 max_tokens 時，限流用的輸出 token 預估值
+DEFAULT_COMPLETION_TOKENS = 800
+
+# 生成通知失敗時回傳的預設訊息（不會被儲存）
+DEFAULT_NOTIFICATION = "今天也記錄一下你的生活故事吧！每一天都值得被記住 ✨"
+
+
+def estimate_request_tokens(messages: list[dict], max_tokens: int = None) -> int:
     """
-    生成日記摘要的函數
+    預估一次對話請求的 token 用量（prompt + 輸出上限），供 llm_gateway 限流使用
+    """
+    prompt_tokens = sum(prompt_budget.estimate_tokens(message["content"]) for message in messages)
+    return prompt_tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+async def build_summary_prompts(client, user_id: str, note_id: str, custom_prompt: str, openai_client) -> tuple[str, str]:
+    """
+    組合日記摘要所需的 system prompt 與 user prompt
     
     Args:
         client: 資料庫客戶端
         user_id: 用戶ID
-        note_id: 日記ID
+        note_id: 日記ID（可用逗號分隔多篇）
         custom_prompt: 自定義摘要需求
-        openai_client: OpenAI 客戶端
+        openai_client: OpenAI 客戶端（多篇日記時用於逐篇摘要）
     
     Returns:
-        str: 生成的摘要
+        tuple[str, str]: (system_prompt, user_prompt)
     """
     
     note_id_list = note_id.split(',')
@@ -42,11 +62,12 @@ async def generate_summary_from_note(client, user_id: str, note_id: str, custom_
 
     根據用戶的特殊需求調整摘要重點和風格。"""
         note_content_all = await db.get_content_from_note_id(client, user_id, note_id)
-        for content in note_content_all['items']:
-            if content['type'] == 'text':
-                note_content += content['content']
+        note_lines = [content['content'] for content in note_content_all['items'] if content['type'] == 'text']
+        note_lines, trim_stats = prompt_budget.fit_lines(note_lines, prompt_budget.ENDPOINT_BUDGETS["summary"])
+        prompt_budget.report_trim("summary", trim_stats)
+        note_content = "".join(note_lines)
         
-        print(f"日記內容：{note_content}")
+        logger.debug("摘要的日記內容", note_id=note_id, content=note_content)
     else:
         system_prompt = """你是一位精煉的敘事摘要專家。
 
@@ -57,13 +78,12 @@ async def generate_summary_from_note(client, user_id: str, note_id: str, custom_
 2.  **長度限制**：整個段落的長度嚴格控制在 3 到 4 個句子以內。
 3.  **聚焦核心**：從所有日記中，找出 1 至 2 個最重要的主題或事件來敘述，並點出期間的整體感受或轉變。拋棄所有次要細節。
 4.  **直接輸出**：不要添加任何前言或標題，直接生成該段落。"""
-        for note_id in note_id_list:
-            note_content += f"{note_id}:\n"
-            note_content_all = await db.get_content_from_note_id(client, user_id, note_id)
-            for content in note_content_all['items']:
-                if content['type'] == 'text':
-                    note_content += f"{note_id}:\n{content['content']}\n"
-            note_content += "\n"  # 每篇日記之間添加空行
+        # Map 階段：每篇日記先各自摘要（有快取），再把這些短摘要交給 reduce 階段融合
+        note_summaries = await summarize_notes_map(client, user_id, note_id_list, openai_client)
+        note_lines = [f"{note_id}:\n{note_summary}\n" for note_id, note_summary in note_summaries]
+        note_lines, trim_stats = prompt_budget.fit_lines(note_lines, prompt_budget.ENDPOINT_BUDGETS["summary_multi"])
+        prompt_budget.report_trim("summary_multi", trim_stats)
+        note_content = "\n".join(note_lines)  # 每篇日記之間添加空行
 
     # 構建 user prompt
     base_prompt = "請為以下日記內容生成摘要，不要輸出換行："
@@ -73,39 +93,251 @@ async def generate_summary_from_note(client, user_id: str, note_id: str, custom_
         system_prompt = custom_prompt
     user_prompt = f"{base_prompt}\n\n日記內容：\n{note_content}"
     
+    return system_prompt, user_prompt
+
+
+def summary_cache_key(model: str, system_prompt: str, user_prompt: str) -> str:
+    """
+    以模型與完整 prompt 內容計算摘要快取的 key，日記內容一改變 key 就會跟著改變
+    """
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, user_prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# 多篇日記摘要時，逐篇摘要（map 階段）使用的 prompt 與併發上限
+NOTE_MAP_SYSTEM_PROMPT = """你是一個日記重點整理助手。
+請用 1 到 2 句繁體中文，寫出這篇日記最重要的事件與當天的整體感受。
+不要添加前言、標題或條列，直接輸出內容。"""
+NOTE_MAP_CONCURRENCY = 4
+
+
+async def summarize_single_note_for_map(client, user_id: str, note_id: str, openai_client, semaphore: asyncio.Semaphore) -> str:
+    """
+    產生單篇日記的短摘要，結果依日記內容快取，內容沒變就不會重新呼叫模型
+    
+    Args:
+        client: 資料庫客戶端
+        user_id: 用戶ID
+        note_id: 日記ID
+        openai_client: OpenAI 客戶端
+        semaphore: 限制同時呼叫模型的數量
+    
+    Returns:
+        str: 單篇日記的短摘要，沒有文字內容時返回空字串
+    """
+    note_text = await db.get_note_text(client, user_id, note_id)
+    if not note_text.strip():
+        return ""
+    note_text, trim_stats = prompt_budget.fit_text(note_text, prompt_budget.ENDPOINT_BUDGETS["note_map"])
+    prompt_budget.report_trim("note_map", trim_stats)
+    
+    model = "gpt-4.1"
+    cache_key = summary_cache_key(model, NOTE_MAP_SYSTEM_PROMPT, note_text)
+    
+    cached = await db.get_cached_summary(client, user_id, cache_key)
+    if cached is not None:
+        return cached
+    
+    messages = [
+        {"role": "system", "content": NOTE_MAP_SYSTEM_PROMPT},
+        {"role": "user", "content": note_text}
+    ]
+    
+    try:
+        async with semaphore:
+            response = await llm_gateway.call(
+                openai_client.chat.completions.create,
+                model=model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=200,
+                tokens=estimate_request_tokens(messages, 200),
+                operation="note_map",
+            )
+        
+        note_summary = response.choices[0].message.content.strip()
+        await db.save_cached_summary(client, user_id, cache_key, note_id, note_summary)
+        
+        return note_summary
+        
+    except llm_gateway.LLMUnavailableError:
+        raise
+    except Exception as e:
+        logger.error("生成單篇日記摘要時發生錯誤", note_id=note_id, error=e)
+        # 無法摘要時退回使用原文，讓 reduce 階段仍有內容可用
+        return note_text
+
+
+async def summarize_notes_map(client, user_id: str, note_id_list: list[str], openai_client) -> list[tuple[str, str]]:
+    """
+    併發讀取並摘要多篇日記（map 階段）
+    
+    Args:
+        client: 資料庫客戶端
+        user_id: 用戶ID
+        note_id_list: 日記ID列表
+        openai_client: OpenAI 客戶端
+    
+    Returns:
+        list[tuple[str, str]]: 依輸入順序排列的 (note_id, 短摘要)，略過沒有文字的日記
+    """
+    semaphore = asyncio.Semaphore(NOTE_MAP_CONCURRENCY)
+    note_summaries = await asyncio.gather(*[
+        summarize_single_note_for_map(client, user_id, note_id, openai_client, semaphore)
+        for note_id in note_id_list
+    ])
+    
+    result = [
+        (note_id, note_summary)
+        for note_id, note_summary in zip(note_id_list, note_summaries)
+        if note_summary
+    ]
+    logger.info("完成逐篇摘要", summarized=len(result), total=len(note_id_list))
+    return result
+
+
+async def generate_summary_from_note(client, user_id: str, note_id: str, custom_prompt: str, openai_client) -> str:
+    """
+    生成日記摘要的函數
+    
+    Args:
+        client: 資料庫客戶端
+        user_id: 用戶ID
+        note_id: 日記ID
+        custom_prompt: 自定義摘要需求
+        openai_client: OpenAI 客戶端
+    
+    Returns:
+        str: 生成的摘要
+    """
+    
+    system_prompt, user_prompt = await build_summary_prompts(client, user_id, note_id, custom_prompt, openai_client)
+    
     model = "gpt-4.1"
+    cache_key = summary_cache_key(model, system_prompt, user_prompt)
+    
+    cached = await db.get_cached_summary(client, user_id, cache_key)
+    if cached is not None:
+        logger.info("使用快取的摘要", user_id=user_id, note_id=note_id)
+        return cached
+    
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
     
     try:
-        response = openai_client.chat.completions.create(
+        response = await llm_gateway.call(
+            openai_client.chat.completions.create,
             model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=messages,
             temperature=0.4,  # 適中的創造性
             top_p=0.9,       # 提高輸出品質
+            tokens=estimate_request_tokens(messages),
+            operation="summary",
         )
         
         summary = response.choices[0].message.content.strip()
-        print(f"生成的摘要：{summary}")
+        logger.debug("生成的摘要", user_id=user_id, note_id=note_id, content=summary)
+        
+        await db.save_cached_summary(client, user_id, cache_key, note_id, summary)
         
         return summary
         
+    except llm_gateway.LLMUnavailableError:
+        raise
     except Exception as e:
-        print(f"生成摘要時發生錯誤: {e}")
+        logger.error("生成摘要時發生錯誤", error=e)
         # 返回簡單的默認摘要
         return "無法生成摘要，請稍後再試。"
 
 
+async def stream_summary_from_note(client, user_id: str, note_id: str, custom_prompt: str, openai_client):
+    """
+    以串流方式生成日記摘要，模型每產生一段文字就立即 yield 出去
+    
+    Args:
+        client: 資料庫客戶端
+        user_id: 用戶ID
+        note_id: 日記ID
+        custom_prompt: 自定義摘要需求
+        openai_client: OpenAI 客戶端
+    
+    Yields:
+        str: 摘要的文字片段；串流結束後完整摘要會寫入快取
+    """
+    
+    system_prompt, user_prompt = await build_summary_prompts(client, user_id, note_id, custom_prompt, openai_client)
+    
+    model = "gpt-4.1"
+    cache_key = summary_cache_key(model, system_prompt, user_prompt)
+    
+    # 命中快取時直接一次送出完整摘要
+    cached = await db.get_cached_summary(client, user_id, cache_key)
+    if cached is not None:
+        logger.info("使用快取的摘要", user_id=user_id, note_id=note_id)
+        yield cached
+        return
+    
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    
+    # OpenAI 客戶端是同步的，建立連線與讀取每個片段都放到執行緒中，避免卡住 event loop。
+    # 整個串流期間都佔用閘道的名額，讀取片段時的錯誤也會計入斷路器
+    started_at = time.perf_counter()
+    parts = []
+    async with llm_gateway.slot(tokens=estimate_request_tokens(messages), operation="summary_stream", model=model):
+        stream = await asyncio.to_thread(
+            openai_client.chat.completions.create,
+            model=model,
+            messages=messages,
+            temperature=0.4,
+            top_p=0.9,
+            stream=True,
+        )
+        iterator = iter(stream)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, iterator, None)
+                if chunk is None:
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            # 客戶端中途斷線時也要關閉上游連線
+            if hasattr(stream, "close"):
+                stream.close()
+    
+    # 串流回應沒有 usage，以片段數作為輸出 token 數
+    metrics.LLM_STREAM_DURATION.observe("summary_stream", model, value=time.perf_counter() - started_at)
+    metrics.LLM_TOKENS.observe("summary_stream", model, "completion", value=len(parts))
+    metrics.LLM_TOKENS_TOTAL.inc("summary_stream", model, "completion", amount=len(parts))
+    
+    summary = "".join(parts).strip()
+    logger.debug("生成的摘要", user_id=user_id, note_id=note_id, content=summary)
+    
+    if summary:
+        await db.save_cached_summary(client, user_id, cache_key, note_id, summary)
+
+
 async def generate_hashtag_from_note(client, user_id: str, note_id: str, openai_client) -> str:
     # 獲取日記內容
     note_content_all = await db.get_content_from_note_id(client, user_id, note_id)
-    note_content = ""
-    for content in note_content_all['items']:
-        if content['type'] == 'text':
-            note_content += content['content'] + "\n"
+    note_lines = [content['content'] for content in note_content_all['items'] if content['type'] == 'text']
+    note_lines, trim_stats = prompt_budget.fit_lines(note_lines, prompt_budget.ENDPOINT_BUDGETS["hashtag"])
+    prompt_budget.report_trim("hashtag", trim_stats)
+    note_content = "".join(line + "\n" for line in note_lines)
     
-    print(f"日記內容：{note_content}")
+    logger.debug("hashtag 的日記內容", note_id=note_id, content=note_content)
     
     # 優化的 system prompt
     system_prompt = """你是一個專業的日記分析助手，擅長從日記內容中提取關鍵信息並生成相關的 hashtag。
@@ -136,20 +368,25 @@ async def generate_hashtag_from_note(client, user_id: str, note_id: str, openai_
 
     model = "gpt-4.1"
     
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    
     try:
-        response = openai_client.chat.completions.create(
+        response = await llm_gateway.call(
+            openai_client.chat.completions.create,
             model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=messages,
             temperature=0.3,  # 降低溫度以獲得更一致的結果
             max_tokens=100,   # 限制輸出長度
+            tokens=estimate_request_tokens(messages, 100),
+            operation="hashtag",
         )
         
         # 取得模型回應並處理
         corrected_text = response.choices[0].message.content.strip()
-        print(f"AI 生成的 hashtags: {corrected_text}")
+        logger.debug("AI 生成的 hashtags", note_id=note_id, raw=corrected_text)
         
         # 清理和處理 hashtags
         corrected_list = [tag.strip() for tag in corrected_text.split(',') if tag.strip()]
@@ -170,58 +407,59 @@ async def generate_hashtag_from_note(client, user_id: str, note_id: str, openai_
             default_tags = ["日常", "生活記錄", "今日感想"]
             cleaned_hashtags.extend(default_tags[:3-len(cleaned_hashtags)])
         
-        print(f"處理後的 hashtags: {cleaned_hashtags}")
+        logger.info("生成 hashtags", user_id=user_id, note_id=note_id, hashtags=cleaned_hashtags)
         
         # 更新資料庫
         await db.update_note_hashtags(client, user_id, note_id, cleaned_hashtags)
         
         return f"{cleaned_hashtags}"
         
+    except llm_gateway.LLMUnavailableError:
+        # 服務暫時無法使用時不寫入預設值，交由呼叫端決定是否重試
+        raise
     except Exception as e:
-        print(f"生成 hashtag 時發生錯誤: {e}")
+        logger.error("生成 hashtag 時發生錯誤", error=e)
         # 返回默認 hashtags
         default_hashtags = ["日記", "生活", "記錄"]
         await db.update_note_hashtags(client, user_id, note_id, default_hashtags)
         return f"{default_hashtags}"
 
-async def generate_notify(client, user_id, openai_client):
+async def generate_notify(client, user_id, openai_client, fallback: bool = True):
+    """
+    根據最近的日記生成通知。fallback 為 False 時，生成失敗會拋出錯誤而不是回傳 DEFAULT_NOTIFICATION
+    """
     note_ids = await db.get_sorted_note_list(client, user_id)
-    print(f"note_ids: {note_ids}")
+    logger.debug("生成通知的筆記", user_id=user_id, note_ids=note_ids)
     
     if len(note_ids) > 5:
         note_ids = note_ids[-5:]  # 只取最近的五篇日記
         
+    # 只需要文字內容，併發讀取且不重組任何媒體檔案
+    note_texts = await asyncio.gather(*[
+        db.get_note_text(client, user_id, note_id) for note_id in note_ids
+    ])
+    
     note_contents = []
-    for note_id in note_ids:
-        note_data = await db.get_content_from_note_id(client, user_id, note_id)
-        
-        # 提取文字內容
-        note_content = ""
-        for content in note_data['items']:
-            if content['type'] == 'text':
-                note_content += content['content']
-        
-        # 假設 note_data 中包含日期信息，你需要根據實際數據結構調整
-        # 這裡需要你確認如何獲取日期，可能的方式：
-        note_date = note_data.get('date') or note_data.get('created_at') or note_data.get('timestamp')
-        
+    for note_id, note_content in zip(note_ids, note_texts):
+        # note_id 即為日記的日期 (YYYYMMDD)
         note_contents.append({
-            "date": note_date,
+            "date": note_id,
             "content": note_content
         })
     
     # 生成個性化通知
-    notification_message = await generate_personalized_notification(openai_client, note_contents)
+    notification_message = await generate_personalized_notification(openai_client, note_contents, fallback)
     
     return notification_message
 
-async def generate_personalized_notification(openai_client, note_contents):
+async def generate_personalized_notification(openai_client, note_contents, fallback: bool = True):
     """使用 ChatGPT API 生成個性化通知訊息"""
     
-    # 構建 prompt
-    recent_entries_text = ""
-    for entry in note_contents:
-        recent_entries_text += f"日期: {entry['date']}\n內容: {entry['content']}\n\n"
+    # 構建 prompt，所有日記合計不超過預算
+    entry_lines = [f"日期: {entry['date']}\n內容: {entry['content']}\n\n" for entry in note_contents]
+    entry_lines, trim_stats = prompt_budget.fit_lines(entry_lines, prompt_budget.ENDPOINT_BUDGETS["notify"])
+    prompt_budget.report_trim("notify", trim_stats)
+    recent_entries_text = "".join(entry_lines)
     
     prompt = f"""
     基於以下用戶最近的日記內容，生成一個溫暖且個性化的通知訊息，鼓勵用戶繼續記錄日記。
@@ -238,30 +476,40 @@ async def generate_personalized_notification(openai_client, note_contents):
     只返回通知訊息，不需要其他說明。
     """
     
+    messages = [
+        {
+            "role": "system", 
+            "content": "你是一個溫暖的日記助手，擅長根據用戶的日記內容生成個性化的鼓勵訊息。"
+        },
+        {
+            "role": "user", 
+            "content": prompt
+        }
+    ]
+    
     try:
-        response = openai_client.chat.completions.create(
+        # 透過閘道在執行緒中呼叫，背景排程生成通知時不會卡住 event loop
+        response = await llm_gateway.call(
+            openai_client.chat.completions.create,
             model="gpt-4.1",  # 或使用 "gpt-4" 
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "你是一個溫暖的日記助手，擅長根據用戶的日記內容生成個性化的鼓勵訊息。"
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
+            messages=messages,
             max_tokens=100,
-            temperature=0.7
+            temperature=0.7,
+            tokens=estimate_request_tokens(messages, 100),
+            operation="notify",
         )
         
         notification = response.choices[0].message.content.strip()
         return notification
         
+    except llm_gateway.LLMUnavailableError:
+        raise
     except Exception as e:
-        print(f"生成通知時發生錯誤: {e}")
+        logger.error("生成通知時發生錯誤", error=e)
+        if not fallback:
+            raise
         # 返回默認通知訊息
-        return "今天也記錄一下你的生活故事吧！每一天都值得被記住 ✨"
+        return DEFAULT_NOTIFICATION
     
 async def get_event_link_from_note(client, user_id: str, note_id: str, openai_client) -> str:
     """
@@ -274,17 +522,25 @@ async def get_event_link_from_note(client, user_id: str, note_id: str, openai_cl
         openai_client: OpenAI 客戶端
     
     Returns:
-        str: 生成的摘要
+        list[dict]: [{"time": "YYYYMMDD", "event": "..."}]，提取結果會儲存到使用者的 events 集合
     """
     
     # 獲取日記內容
-    note_content_all = await db.get_content_from_note_id(client, user_id, note_id)
-    note_content = ""
-    for content in note_content_all['items']:
-        if content['type'] == 'text':
-            note_content += content['content']
+    note_lines = await db.get_note_text_lines(client, user_id, note_id)
+    
+    # 文字內容與上次提取時相同，直接回傳已儲存的行程
+    text_hash = hashlib.sha256(f"{note_id}\0{''.join(note_lines)}".encode('utf-8')).hexdigest()
+    event_source = await db.get_note_event_source(client, user_id, note_id)
+    if event_source is not None and event_source.get("text_hash") == text_hash:
+        events = await db.get_note_events(client, user_id, note_id)
+        logger.info("日記內容未變動，使用已儲存的行程", user_id=user_id, note_id=note_id, count=len(events))
+        return events
+    
+    note_lines, trim_stats = prompt_budget.fit_lines(note_lines, prompt_budget.ENDPOINT_BUDGETS["link"])
+    prompt_budget.report_trim("link", trim_stats)
+    note_content = "".join(note_lines)
     
-    print(f"日記內容：{note_content}")
+    logger.debug("行程提取的日記內容", note_id=note_id, content=note_content)
     
     # 優化的 system prompt
     system_prompt = """你是一位專業的行程提取助理。你的任務是從使用者提供的日記文本中，精確地提取出所有包含具體日期的待辦事項或活動。
@@ -345,25 +601,42 @@ async def get_event_link_from_note(client, user_id: str, note_id: str, openai_cl
     
     model = "gpt-4.1"
     
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    
     try:
-        response = openai_client.chat.completions.create(
+        response = await llm_gateway.call(
+            openai_client.chat.completions.create,
             model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=messages,
             temperature=0.2,
             top_p=0.2,
+            tokens=estimate_request_tokens(messages),
+            operation="link",
         )
         
         result = response.choices[0].message.content.strip()
         result = json.loads(result)  # 解析 JSON 字符串
-        print(f"生成的摘要：{result}")
+        logger.debug("提取的行程", user_id=user_id, note_id=note_id, events=result)
+        
+        # 只保留格式正確的行程
+        events = [
+            {"time": item["time"], "event": item["event"]}
+            for item in result
+            if isinstance(item, dict)
+            and isinstance(item.get("time"), str) and len(item["time"]) == 8 and item["time"].isdigit()
+            and isinstance(item.get("event"), str)
+        ]
+        await db.replace_note_events(client, user_id, note_id, text_hash, events)
         
-        return result
+        return events
         
+    except llm_gateway.LLMUnavailableError:
+        raise
     except Exception as e:
-        print(f"生成摘要時發生錯誤: {e}")
+        logger.error("生成摘要時發生錯誤", error=e)
         # 返回簡單的默認摘要
         return "無法生成摘要，請稍後再試。"
 
@@ -373,7 +646,9 @@ def main():
     if not api_key:
         raise ValueError("請先設定環境變數 MISTRAL_API_KEY")
     
-    # 初始化 Mistral 客戶端
+    # 初始化 Mistral 客戶端（只有這個範例用到，不在匯入時載入 SDK）
+    from mistralai import Mistral
+
     client = Mistral(api_key=api_key)
     
     # 定義要使用的模型
@@ -400,7 +675,7 @@ def main():
     
     # 取得模型回應並輸出
     corrected_text = response.choices[0].message.content
-    print(corrected_text)
+    logger.info("範例日記", diary=corrected_text)
     
 """
 今天，2023年10月10日，天氣陰沉，偶爾還飄著細雨。雖然天氣不太好，但我還是決定出門走走，去了附近的咖啡館。在那裡，我點了一杯拿鐵，邊喝邊看了一本新買的小說。
@@ -0,0 +1,155 @@
+import asyncio
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+import logs
+
+logger = logs.get_logger(__name__)
+
+# 單一請求的效能分析設定，可用環境變數調整
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")                              # 分析結果的存放目錄
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))                    # 最多保留的分析結果，超過時刪除最舊的
+PROFILE_HEADER = "x-profile"                                                     # 帶上此 header（值為 ADMIN_TOKEN）即分析該請求
+
+# 管理端可調整的取樣設定：sample_rate 為 0 時只分析帶 header 的請求
+_settings = {
+    "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    "route_prefix": os.getenv("PROFILE_ROUTE_PREFIX", "/api/"),
+}
+
+# cProfile 同一時間只能有一個在執行，其他請求在分析期間不會被取樣
+_active = threading.Lock()
+
+
+def get_settings() -> dict:
+    return {**_settings, "max_files": PROFILE_MAX_FILES, "directory": PROFILE_DIR}
+
+
+def update_settings(sample_rate: float = None, route_prefix: str = None) -> dict:
+    """
+    調整取樣比例與要取樣的路徑前綴
+    """
+    if sample_rate is not None:
+        _settings["sample_rate"] = min(max(sample_rate, 0.0), 1.0)
+    if route_prefix is not None:
+        _settings["route_prefix"] = route_prefix
+    return get_settings()
+
+
+def should_profile(path: str, requested: bool) -> bool:
+    """
+    判斷是否分析這個請求。未開啟取樣且沒有帶 header 時只做一次比較。
+    """
+    if requested:
+        return True
+    rate = _settings["sample_rate"]
+    return rate > 0 and path.startswith(_settings["route_prefix"]) and random.random() < rate
+
+
+async def profile_request(request, call_next):
+    """
+    以 cProfile 分析單一請求，結果與路由、參數一起寫入磁碟。
+
+    cProfile 記錄 event loop 執行緒上的所有活動，分析期間同時處理的其他請求也會出現在結果中；
+    asyncio.to_thread 執行的工作（例如 MongoDB 查詢）只會以等待時間呈現。
+    """
+    if not _active.acquire(blocking=False):
+        return await call_next(request)
+
+    profiler = cProfile.Profile()
+    started_at = time.perf_counter()
+    status_code = 500
+    try:
+        profiler.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.disable()
+        status_code = response.status_code
+        return response
+    finally:
+        _active.release()
+        route = request.scope.get("route")
+        metadata = {
+            "method": request.method,
+            "path": request.url.path,
+            "route": getattr(route, "path", None),
+            "path_params": dict(request.path_params),
+            "query_params": logs.redact(dict(request.query_params)),
+            "status": status_code,
+            "duration_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            "request_id": logs.request_id_var.get(),
+        }
+        try:
+            await asyncio.to_thread(_save_profile, profiler, metadata)
+        except Exception as e:
+            logger.error("儲存效能分析結果時發生錯誤", path=request.url.path, error=e)
+
+
+def _save_profile(profiler: cProfile.Profile, metadata: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    profile_id = f"{now.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    metadata = {"id": profile_id, "created_at": now.isoformat(), **metadata}
+
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False)
+
+    # 環狀保留：超過上限時刪除最舊的結果
+    for old_id in _profile_ids()[PROFILE_MAX_FILES:]:
+        for ext in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{old_id}{ext}"))
+            except FileNotFoundError:
+                pass
+
+    logger.info("已儲存效能分析結果", profile_id=profile_id, route=metadata["route"], duration_ms=metadata["duration_ms"])
+
+
+def _profile_ids() -> list[str]:
+    # 檔名以時間開頭，反向排序即為由新到舊
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True)
+
+
+def list_profiles() -> list[dict]:
+    """
+    列出保留中的分析結果（由新到舊）
+    """
+    profiles = []
+    for profile_id in _profile_ids():
+        try:
+            with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), encoding="utf-8") as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id: str) -> str | None:
+    """
+    取得分析結果的 .prof 檔案路徑，不存在或 ID 不合法時返回 None
+    """
+    if profile_id not in _profile_ids():
+        return None
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def render_text(path: str, limit: int = 50) -> str:
+    """
+    將分析結果輸出為依累計時間排序的文字報表
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,166 @@
+import math
+
+import logs
+
+logger = logs.get_logger(__name__)
+
+# 各 AI 端點允許放入 prompt 的日記內容 token 上限（不含 system prompt）
+ENDPOINT_BUDGETS = {
+    "summary": 6000,        # 單篇日記摘要
+    "summary_multi": 4000,  # 多篇日記的 reduce 階段
+    "note_map": 3000,       # 多篇日記時的逐篇摘要
+    "hashtag": 2000,
+    "notify": 2500,         # 最近五篇日記合計
+    "link": 4000,
+}
+
+# 被截斷的位置會插入這個標記，讓模型知道中間有內容被省略
+ELLIPSIS = "……（中略）……"
+
+# 每行至少保留的 token 數，避免長行被切到只剩幾個字
+MIN_LINE_TOKENS = 32
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (
+        0x3040 <= code <= 0x30FF      # 日文假名
+        or 0x3400 <= code <= 0x4DBF   # CJK 擴充 A
+        or 0x4E00 <= code <= 0x9FFF   # CJK 統一表意文字
+        or 0xAC00 <= code <= 0xD7AF   # 韓文
+        or 0xF900 <= code <= 0xFAFF   # CJK 相容表意文字
+        or 0xFF00 <= code <= 0xFFEF   # 全形符號
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文字的 token 數。中日韓字元大約一字一個 token，其他字元大約四個字元一個 token。
+    估算值刻意偏高，實際 token 數通常不會超過。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if _is_cjk(char))
+    other = len(text) - cjk
+    return cjk + math.ceil(other / 4)
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """
+    將文字截斷到 max_tokens 以內，保留開頭與結尾，省略中間的部分。
+    同樣的輸入永遠得到同樣的輸出。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    available = max(max_tokens - estimate_tokens(ELLIPSIS), 2)
+
+    # 以二分搜尋找出頭尾各能保留多少字元
+    low, high = 0, len(text) // 2
+    while low < high:
+        keep = (low + high + 1) // 2
+        if estimate_tokens(text[:keep]) + estimate_tokens(text[-keep:]) <= available:
+            low = keep
+        else:
+            high = keep - 1
+
+    if low == 0:
+        return ELLIPSIS
+    return f"{text[:low]}{ELLIPSIS}{text[-low:]}"
+
+
+def fit_lines(lines: list[str], budget: int) -> tuple[list[str], dict]:
+    """
+    讓多行日記內容符合 token 預算。
+
+    1. 先把過長的行截斷成頭尾保留的形式，每行上限依剩餘預算平均分配
+    2. 若仍超過預算，從中間開始均勻丟棄整行，保留最前與最後的內容
+
+    參數:
+    - lines: 日記內容，每個元素為一行
+    - budget: token 上限
+
+    返回:
+    - (符合預算的行, 統計資訊)
+    """
+    original_tokens = sum(estimate_tokens(line) for line in lines)
+    stats = {
+        "budget": budget,
+        "original_tokens": original_tokens,
+        "final_tokens": original_tokens,
+        "trimmed_tokens": 0,
+        "truncated_lines": 0,
+        "dropped_lines": 0,
+    }
+
+    if original_tokens <= budget or not lines:
+        return list(lines), stats
+
+    # 步驟 1：計算每行上限。短行維持原樣，把省下的預算平均分給長行
+    sizes = sorted(estimate_tokens(line) for line in lines)
+    remaining_budget = budget
+    remaining_lines = len(sizes)
+    line_cap = budget
+    for size in sizes:
+        share = remaining_budget // remaining_lines
+        if size > share:
+            line_cap = share
+            break
+        remaining_budget -= size
+        remaining_lines -= 1
+    line_cap = max(line_cap, MIN_LINE_TOKENS)
+
+    fitted = []
+    for line in lines:
+        if estimate_tokens(line) > line_cap:
+            fitted.append(truncate_middle(line, line_cap))
+            stats["truncated_lines"] += 1
+        else:
+            fitted.append(line)
+
+    # 步驟 2：仍然超過時，從中間往外依序丟棄整行
+    total = sum(estimate_tokens(line) for line in fitted)
+    if total > budget:
+        center = (len(fitted) - 1) / 2
+        drop_order = sorted(range(len(fitted)), key=lambda index: (abs(index - center), index))
+        dropped = set()
+        for index in drop_order:
+            if total <= budget or len(dropped) == len(fitted) - 1:
+                break
+            total -= estimate_tokens(fitted[index])
+            dropped.add(index)
+        fitted = [line for index, line in enumerate(fitted) if index not in dropped]
+        stats["dropped_lines"] = len(dropped)
+
+        # 只剩一行仍然超過時，直接截斷該行
+        if total > budget:
+            fitted = [truncate_middle(fitted[0], budget)]
+            total = estimate_tokens(fitted[0])
+
+    stats["final_tokens"] = total
+    stats["trimmed_tokens"] = original_tokens - total
+    return fitted, stats
+
+
+def fit_text(text: str, budget: int) -> tuple[str, dict]:
+    """
+    讓單一段文字符合 token 預算，以換行切分後交給 fit_lines 處理。
+    """
+    lines, stats = fit_lines(text.split("\n"), budget)
+    return "\n".join(lines), stats
+
+
+def report_trim(endpoint: str, stats: dict):
+    """
+    有內容被裁剪時輸出裁剪資訊
+    """
+    if stats["trimmed_tokens"] > 0:
+        logger.info(
+            "prompt 超過預算，已裁剪",
+            endpoint=endpoint,
+            budget=stats["budget"],
+            original_tokens=stats["original_tokens"],
+            final_tokens=stats["final_tokens"],
+            truncated_lines=stats["truncated_lines"],
+            dropped_lines=stats["dropped_lines"]
+        )
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import os
+
+import db
+import mistral
+import logs
+
+logger = logs.get_logger(__name__)
+
+# 排程設定，可用環境變數調整
+NOTIFY_SCHEDULER_INTERVAL = int(os.getenv("NOTIFY_SCHEDULER_INTERVAL", "60"))  # 每次檢查的間隔（秒）
+NOTIFY_REFRESH_HOURS = int(os.getenv("NOTIFY_REFRESH_HOURS", "24"))            # 沒有變動時多久更新一次
+NOTIFY_ACTIVE_DAYS = int(os.getenv("NOTIFY_ACTIVE_DAYS", "30"))                # 多久內有變動才算活躍使用者
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "20"))                  # 每次最多處理的使用者數
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "4"))                 # 同時生成通知的數量
+
+_scheduler_task = None
+
+
+async def refresh_user_notification(client, user_id: str, openai_client) -> str:
+    """
+    重新生成指定使用者的通知並儲存。生成失敗時拋出錯誤，不會儲存預設訊息
+    
+    參數:
+    - client: MongoDB 客戶端連接
+    - user_id: 使用者 ID
+    - openai_client: OpenAI 客戶端
+    
+    返回:
+    - 生成的通知內容
+    """
+    generated_at = datetime.datetime.now()
+    message = await mistral.generate_notify(client, user_id, openai_client, fallback=False)
+    await db.save_notification(client, user_id, message, generated_at)
+    return message
+
+
+async def run_notification_batch(client, openai_client) -> int:
+    """
+    處理一批需要更新通知的使用者
+    
+    返回:
+    - 本次成功更新的使用者數
+    """
+    now = datetime.datetime.now()
+    user_ids = await db.get_users_needing_notification(
+        client,
+        refresh_before=now - datetime.timedelta(hours=NOTIFY_REFRESH_HOURS),
+        active_after=now - datetime.timedelta(days=NOTIFY_ACTIVE_DAYS),
+        limit=NOTIFY_BATCH_SIZE
+    )
+    
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    
+    async def _refresh(user_id) -> bool:
+        async with semaphore:
+            try:
+                await refresh_user_notification(client, user_id, openai_client)
+                return True
+            except Exception as e:
+                logger.error("預先生成通知時發生錯誤", user_id=user_id, error=e)
+                return False
+    
+    results = await asyncio.gather(*[_refresh(user_id) for user_id in user_ids])
+    refreshed = sum(results)
+    
+    if user_ids:
+        logger.info("已預先生成通知", users=refreshed, failed=len(user_ids) - refreshed)
+    return refreshed
+
+
+async def _scheduler_loop(client, openai_client):
+    while True:
+        try:
+            refreshed = await run_notification_batch(client, openai_client)
+        except Exception as e:
+            logger.error("通知排程執行時發生錯誤", error=e)
+            refreshed = 0
+        
+        # 一批全部更新成功時代表可能還有待處理的使用者，稍作停頓後處理下一批；
+        # 有失敗時（例如 LLM 服務中斷）照常等待，避免每秒重試同一批使用者
+        await asyncio.sleep(NOTIFY_SCHEDULER_INTERVAL if refreshed < NOTIFY_BATCH_SIZE else 1)
+
+
+def start_notification_scheduler(client, openai_client):
+    """
+    啟動背景通知排程，需在 event loop 中呼叫。索引由 db.ensure_indexes 在啟動時建立。
+    """
+    global _scheduler_task
+    
+    if client is None or _scheduler_task is not None:
+        return
+    
+    _scheduler_task = asyncio.create_task(_scheduler_loop(client, openai_client))
+    logger.info("通知排程已啟動")
+
+
+async def stop_notification_scheduler():
+    """
+    停止背景通知排程
+    """
+    global _scheduler_task
+    
+    if _scheduler_task is None:
+        return
+    
+    _scheduler_task.cancel()
+    try:
+        await _scheduler_task
+    except asyncio.CancelledError:
+        pass
+    _scheduler_task = None
+    logger.info("通知排程已停止")
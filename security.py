@@ -1,9 +1,126 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密碼雜湊設定，可用環境變數調整
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))                        # bcrypt cost，調整後舊密碼會在下次登入時重新雜湊
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))         # 專用執行緒數量，限制 bcrypt 同時佔用的 CPU
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))  # 排隊中加上執行中的上限，超過時直接拒絕
+
+# min_rounds 與 max_rounds 都設為目前的 cost，cost 不同的雜湊都會被視為需要更新
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# 密碼雜湊統計
+HASH_STATS = {
+    "hashes": 0,
+    "verifies": 0,
+    "rehashes": 0,
+    "rejected": 0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0,
+    "run_seconds_total": 0.0,
+}
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+_pending_lock = threading.Lock()
+_recent_waits = deque(maxlen=1000)  # 最近的排隊時間，用於計算百分位數
+
+
+class PasswordHasherBusyError(Exception):
+    """
+    排隊等待雜湊的請求超過上限
+    """
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+
+async def _run(fn, *args):
+    """
+    在專用的執行緒池中執行 bcrypt，並記錄排隊與執行時間
+    """
+    global _pending
+
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            HASH_STATS["rejected"] += 1
+            raise PasswordHasherBusyError("密碼驗證請求過多，請稍後再試")
+        _pending += 1
+
+    submitted_at = time.perf_counter()
+
+    def _timed():
+        started_at = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            wait = started_at - submitted_at
+            _recent_waits.append(wait)
+            HASH_STATS["queue_wait_seconds_total"] += wait
+            HASH_STATS["queue_wait_seconds_max"] = max(HASH_STATS["queue_wait_seconds_max"], wait)
+            HASH_STATS["run_seconds_total"] += time.perf_counter() - started_at
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, _timed)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    """
+    以目前的 cost 雜湊密碼，不佔用 event loop
+    """
+    HASH_STATS["hashes"] += 1
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    驗證密碼，雜湊的 cost 與目前設定不同時一併產生新的雜湊
+
+    返回:
+    - (是否正確, 新的雜湊)，不需要更新時新的雜湊為 None
+    """
+    HASH_STATS["verifies"] += 1
+    verified, new_hash = await _run(pwd_context.verify_and_update, password, hashed_password)
+    if new_hash is not None:
+        HASH_STATS["rehashes"] += 1
+    return verified, new_hash
+
+
+def get_stats() -> dict:
+    """
+    取得密碼雜湊的統計，包含排隊時間的百分位數
+    """
+    waits = sorted(_recent_waits)
+
+    def _percentile(p):
+        return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+    completed = HASH_STATS["hashes"] + HASH_STATS["verifies"] - HASH_STATS["rejected"]
+    return {
+        **HASH_STATS,
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "pending": _pending,
+        "queue_wait_seconds_avg": HASH_STATS["queue_wait_seconds_total"] / completed if completed > 0 else 0.0,
+        "queue_wait_seconds_p50": _percentile(0.5),
+        "queue_wait_seconds_p95": _percentile(0.95),
+    }
@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import monitoring
+
+import dbtrace
+import logs
+import metrics
+
+logger = logs.get_logger(__name__)
+
+# 慢查詢紀錄設定，可用環境變數調整
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))                   # 超過此時間的指令會被記錄
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"                                # 是否對新的慢查詢形狀執行 explain
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = int(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "3600"))  # 同一形狀重新 explain 的間隔
+SLOW_QUERY_EXPLAIN_PER_MINUTE = int(os.getenv("SLOW_QUERY_EXPLAIN_PER_MINUTE", "10"))          # 每分鐘最多執行的 explain 次數
+SLOW_QUERY_MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES", "500"))                          # 最多保留的查詢形狀，超過時移除總時間最少的
+
+# 不記錄的指令：連線管理與 explain 本身
+_IGNORED_COMMANDS = {
+    "explain", "hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue",
+    "endSessions", "killCursors", "buildInfo", "getLastError",
+}
+# 可以安全 explain 的唯讀指令
+_EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+# 驅動程式附加的欄位，explain 時需要移除
+_DRIVER_FIELDS = {"lsid", "txnNumber", "readConcern", "writeConcern", "autocommit", "startTransaction"}
+
+# 查詢形狀 -> 統計資料
+_shapes = {}
+_lock = threading.Lock()
+_explain_times = []
+
+# explain 在背景的單一執行緒執行，不佔用請求的時間
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+
+SLOW_QUERIES = metrics.Counter(
+    "mongo_slow_queries_total", "超過門檻的 MongoDB 指令數", ("command", "collection_kind")
+)
+
+
+def _shape_key(command_name: str, command: dict) -> tuple[str, str, str | None, str | None]:
+    collection = command.get(command_name)
+    query = dbtrace.command_filter(command_name, command)
+    shape = json.dumps(dbtrace.filter_shape(query), sort_keys=True) if query is not None else None
+    sort = command.get("sort")
+    return (
+        command_name,
+        metrics.collection_kind(collection),
+        shape,
+        json.dumps(sort) if isinstance(sort, dict) else None,
+    )
+
+
+def _take_explain_slot(entry: dict, now: float) -> bool:
+    # 呼叫端需持有 _lock
+    if not SLOW_QUERY_EXPLAIN or entry["command"] not in _EXPLAINABLE_COMMANDS:
+        return False
+    if entry["explain_requested_at"] is not None and now - entry["explain_requested_at"] < SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS:
+        return False
+    while _explain_times and now - _explain_times[0] > 60:
+        _explain_times.pop(0)
+    if len(_explain_times) >= SLOW_QUERY_EXPLAIN_PER_MINUTE:
+        return False
+    _explain_times.append(now)
+    entry["explain_requested_at"] = now
+    return True
+
+
+def _evict():
+    # 呼叫端需持有 _lock；在加入新的形狀之前呼叫，新形狀不會被立即移除
+    while _shapes and len(_shapes) >= SLOW_QUERY_MAX_SHAPES:
+        key = min(_shapes, key=lambda key: _shapes[key]["total_ms"])
+        del _shapes[key]
+
+
+def _explain_command(command_name: str, command: dict) -> dict | None:
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        # 含寫入階段的 pipeline 不 explain
+        if any("$out" in stage or "$merge" in stage for stage in pipeline):
+            return None
+    return {
+        key: value for key, value in command.items()
+        if key not in _DRIVER_FIELDS and not key.startswith("$")
+    }
+
+
+def _find_key(document, key: str):
+    # aggregate 的 explain 結果會把 queryPlanner 包在 $cursor 階段中
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        values = document.values()
+    elif isinstance(document, list):
+        values = document
+    else:
+        return None
+    for value in values:
+        found = _find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _plan_stages(plan, stages: list, indexes: list):
+    if isinstance(plan, dict):
+        stage = plan.get("stage")
+        if stage:
+            stages.append(stage)
+        if plan.get("indexName"):
+            indexes.append(plan["indexName"])
+        for child in (plan.get("inputStage"), *plan.get("inputStages", [])):
+            _plan_stages(child, stages, indexes)
+
+
+def summarize_explain(result: dict) -> dict:
+    """
+    從 explain("executionStats") 的結果取出掃描方式、使用的索引與掃描數量
+    """
+    stages, indexes = [], []
+    _plan_stages(_find_key(result, "winningPlan"), stages, indexes)
+    execution = _find_key(result, "executionStats") or {}
+
+    if "COLLSCAN" in stages:
+        scan = "COLLSCAN"
+    elif "IXSCAN" in stages or "IDHACK" in stages or "EXPRESS_IXSCAN" in stages:
+        scan = "IXSCAN"
+    else:
+        scan = stages[-1] if stages else None
+
+    return {
+        "scan": scan,
+        "stages": stages,
+        "indexes": indexes,
+        "docs_examined": execution.get("totalDocsExamined"),
+        "keys_examined": execution.get("totalKeysExamined"),
+        "returned": execution.get("nReturned"),
+        "execution_ms": execution.get("executionTimeMillis"),
+    }
+
+
+def _run_explain(client, database_name: str, key: tuple, command_name: str, command: dict):
+    explain = _explain_command(command_name, command)
+    if explain is None:
+        return
+    try:
+        result = client[database_name].command(
+            {"explain": explain, "verbosity": "executionStats"}
+        )
+        plan = summarize_explain(result)
+    except Exception as e:
+        logger.error("慢查詢 explain 時發生錯誤", command=command_name, collection_kind=key[1], error=e)
+        plan = {"error": str(e)}
+
+    with _lock:
+        entry = _shapes.get(key)
+        if entry is not None:
+            entry["plan"] = plan
+            entry["explained_at"] = time.time()
+
+    if plan.get("scan") == "COLLSCAN":
+        logger.warning("慢查詢使用全集合掃描", command=command_name, collection_kind=key[1], shape=key[2], sort=key[3])
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+    記錄超過 SLOW_QUERY_THRESHOLD_MS 的指令與其查詢形狀，新的慢查詢形狀會在背景執行 explain。
+    未超過門檻的指令只做一次 dict 存取。
+
+    client 需在建立 MongoClient 後設定，未設定時只記錄不 explain。
+    """
+    def __init__(self):
+        self.client = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        with self._pending_lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def _finish(self, event, failed: bool):
+        with self._pending_lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < SLOW_QUERY_THRESHOLD_MS:
+            return
+
+        database_name, command = pending
+        command_name = event.command_name
+        key = _shape_key(command_name, command)
+        now = time.time()
+
+        with _lock:
+            entry = _shapes.get(key)
+            if entry is None:
+                _evict()
+                entry = _shapes[key] = {
+                    "command": command_name,
+                    "collection_kind": key[1],
+                    "shape": key[2],
+                    "sort": key[3],
+                    "count": 0,
+                    "failed": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen": now,
+                    "last_seen": now,
+                    "sample_collection": command.get(command_name),
+                    "plan": None,
+                    "explained_at": None,
+                    "explain_requested_at": None,
+                }
+            entry["count"] += 1
+            entry["failed"] += int(failed)
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = now
+            explain = self.client is not None and not failed and _take_explain_slot(entry, now)
+
+        SLOW_QUERIES.inc(command_name, key[1])
+        logger.warning(
+            "MongoDB 慢查詢",
+            command=command_name,
+            collection=command.get(command_name),
+            shape=key[2],
+            sort=key[3],
+            duration_ms=round(duration_ms, 1),
+            failed=failed
+        )
+
+        if explain:
+            _explain_executor.submit(_run_explain, self.client, database_name, key, command_name, command)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+def top_offenders(limit: int = 20) -> list[dict]:
+    """
+    依總時間排序的慢查詢形狀，包含最近一次 explain 的掃描方式（COLLSCAN / IXSCAN）
+    """
+    with _lock:
+        entries = [dict(entry) for entry in _shapes.values()]
+    entries.sort(key=lambda entry: entry["total_ms"], reverse=True)
+    for entry in entries:
+        entry.pop("explain_requested_at")
+        entry["total_ms"] = round(entry["total_ms"], 1)
+        entry["max_ms"] = round(entry["max_ms"], 1)
+        entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 1)
+        entry["scan"] = (entry["plan"] or {}).get("scan")
+    return entries[:limit]
+
+
+def reset():
+    """
+    清除累計的慢查詢統計
+    """
+    with _lock:
+        _shapes.clear()
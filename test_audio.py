@@ -0,0 +1,60 @@
+import asyncio
+import struct
+
+import numpy as np
+import pytest
+
+import audio
+
+
+def _float32_wav(samples: np.ndarray, sample_rate: int = 16000) -> bytes:
+    # IEEE float（格式 3）的 WAV，wave 模組無法解碼
+    data = samples.astype("<f4").tobytes()
+    fmt = struct.pack("<HHIIHH", 3, 1, sample_rate, sample_rate * 4, 4, 32)
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(data)) + data
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def _tone(seconds: float, sample_rate: int = 16000) -> np.ndarray:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+def test_decode_float_wav_raises_decode_error():
+    with pytest.raises(audio.AudioDecodeError):
+        audio.decode_wav(_float32_wav(_tone(0.5)))
+    with pytest.raises(audio.AudioDecodeError):
+        audio.preprocess_for_transcription(_float32_wav(_tone(0.5)))
+
+
+@pytest.mark.parametrize("preprocess", [True, False])
+def test_undecodable_wav_falls_back_to_single_call(monkeypatch, preprocess):
+    transcription = pytest.importorskip("transcription")
+    calls = []
+
+    async def fake_transcribe_single(openai_client, content, filename, language):
+        calls.append(content)
+        return "text"
+
+    monkeypatch.setattr(transcription, "TRANSCRIBE_PREPROCESS", preprocess)
+    monkeypatch.setattr(transcription, "transcribe_single", fake_transcribe_single)
+    content = _float32_wav(_tone(0.5))
+
+    assert asyncio.run(transcription.transcribe_uncached(None, content, "a.wav", "zh-TW")) == "text"
+    assert calls == [content]
+
+    monkeypatch.setattr(transcription, "PROVIDER_MAX_BYTES", len(content) - 1)
+    with pytest.raises(transcription.AudioTooLargeError):
+        asyncio.run(transcription.transcribe_uncached(None, content, "a.wav", "zh-TW"))
+
+
+def test_low_level_noise_is_silent():
+    rng = np.random.default_rng(0)
+    # 約 -80 dBFS 的雜訊
+    noise = (rng.standard_normal(32000) * 1e-4).astype(np.float32)
+    _, stats = audio.preprocess_for_transcription(audio.encode_wav(noise, 16000))
+    assert stats["processed_seconds"] == 0
+
+    speech = np.concatenate([noise, _tone(1.0)])
+    _, stats = audio.preprocess_for_transcription(audio.encode_wav(speech, 16000))
+    assert 0.9 <= stats["processed_seconds"] <= 1.1
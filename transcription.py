@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+
+import db
+import llm_gateway
+import logs
+
+logger = logs.get_logger(__name__)
+
+TRANSCRIBE_MODEL = "gpt-4o-transcribe"
+PROVIDER_MAX_BYTES = 25 * 1024 * 1024  # OpenAI 單次轉錄的檔案大小上限
+
+# 長音檔切割設定，可用環境變數調整
+TRANSCRIBE_SPLIT_SECONDS = float(os.getenv("TRANSCRIBE_SPLIT_SECONDS", "180"))      # 超過此長度的 WAV 會切段
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "90"))   # 每段目標長度
+TRANSCRIBE_MAX_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_MAX_SEGMENT_SECONDS", "150"))  # 每段最長長度
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))              # 單一音檔同時轉錄的段數
+
+# 轉錄結果快取設定：記憶體快取在前，MongoDB 快取在後
+TRANSCRIPT_CACHE_TTL_SECONDS = int(os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+TRANSCRIPT_MEMORY_CACHE_SIZE = int(os.getenv("TRANSCRIPT_MEMORY_CACHE_SIZE", "512"))
+TRANSCRIPT_MEMORY_CACHE_TTL_SECONDS = int(os.getenv("TRANSCRIPT_MEMORY_CACHE_TTL_SECONDS", "3600"))
+
+# 轉錄前處理（轉單聲道、降到 16 kHz、壓縮靜音）
+TRANSCRIBE_PREPROCESS = os.getenv("TRANSCRIBE_PREPROCESS", "1") == "1"
+
+# 轉錄統計
+TRANSCRIBE_STATS = {
+    "memory_cache_hits": 0,
+    "mongo_cache_hits": 0,
+    "transcriptions": 0,
+    "preprocessed_files": 0,
+    "preprocess_original_bytes": 0,
+    "preprocess_processed_bytes": 0,
+    "preprocess_original_seconds": 0.0,
+    "preprocess_processed_seconds": 0.0,
+}
+
+_memory_cache = OrderedDict()  # key -> (expires_at, text)
+_inflight = {}                 # key -> 進行中的轉錄 Task，相同音檔同時上傳只轉錄一次
+
+# 語言代碼轉換 (如果需要)
+LANGUAGE_MAPPING = {
+    "zh-TW": "zh-TW",
+    "en": "en",
+    "ja": "ja",
+    "ko": "ko",
+    # 可以根據需要添加更多語言映射
+}
+
+
+class AudioTooLargeError(ValueError):
+    """
+    音檔超過提供者上限且無法在伺服器端切割（非 WAV 或無法解碼的 WAV）
+    """
+
+
+async def transcribe_single(openai_client, content: bytes, filename: str, language: str) -> str:
+    """
+    以單次呼叫轉錄音檔
+    """
+    audio_file = io.BytesIO(content)
+    audio_file.name = filename  # 設定檔名，OpenAI 需要這個來判斷格式
+
+    # 呼叫 OpenAI Whisper API（透過 llm_gateway 限流與重試）
+    response = await llm_gateway.call(
+        openai_client.audio.transcriptions.create,
+        model=TRANSCRIBE_MODEL,
+        file=audio_file,
+        language=LANGUAGE_MAPPING.get(language, language),  # 指定語言可以提高準確性
+        response_format="text",     # 直接返回文字，也可以選擇 "json", "srt", "verbose_json", "vtt"
+        temperature=0.2,            # 降低溫度以獲得更一致的結果
+        operation="transcribe",
+    )
+
+    # OpenAI 直接返回文字內容
+    return response.strip() if isinstance(response, str) else response.text.strip()
+
+
+async def transcribe_segmented(openai_client, samples, sample_rate: int, filename: str, language: str) -> str:
+    """
+    在靜音處將長音檔切段，併發轉錄後依序接合。
+    各段以 16 kHz 單聲道重新編碼，高取樣率的音檔切段後也不會超過提供者的大小上限。
+    """
+    import audio  # 依賴 numpy，使用時才載入以加快啟動
+    mono = await asyncio.to_thread(audio.resample, audio.to_mono(samples), sample_rate, audio.TARGET_SAMPLE_RATE)
+    sample_rate = audio.TARGET_SAMPLE_RATE
+    segments = await asyncio.to_thread(
+        audio.plan_segments, mono, sample_rate, TRANSCRIBE_SEGMENT_SECONDS, TRANSCRIBE_MAX_SEGMENT_SECONDS
+    )
+    logger.info("長音檔切段轉錄", segments=len(segments))
+
+    semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+    base_name = os.path.splitext(filename)[0]
+
+    async def _transcribe_segment(index: int, start: int, end: int) -> str:
+        async with semaphore:
+            segment_bytes = await asyncio.to_thread(audio.encode_wav, mono[start:end], sample_rate)
+            return await transcribe_single(openai_client, segment_bytes, f"{base_name}_{index}.wav", language)
+
+    texts = await asyncio.gather(*[
+        _transcribe_segment(index, start, end)
+        for index, (start, end, _) in enumerate(segments)
+    ])
+    return audio.merge_overlapping_texts(texts, [overlaps for _, _, overlaps in segments])
+
+
+def record_preprocess_stats(stats: dict):
+    """
+    累計並輸出前處理節省的資料量
+    """
+    TRANSCRIBE_STATS["preprocessed_files"] += 1
+    TRANSCRIBE_STATS["preprocess_original_bytes"] += stats["original_bytes"]
+    TRANSCRIBE_STATS["preprocess_processed_bytes"] += stats["processed_bytes"]
+    TRANSCRIBE_STATS["preprocess_original_seconds"] += stats["original_seconds"]
+    TRANSCRIBE_STATS["preprocess_processed_seconds"] += stats["processed_seconds"]
+
+    ratio = stats["original_bytes"] / max(stats["processed_bytes"], 1)
+    logger.info(
+        "轉錄前處理",
+        original_bytes=stats["original_bytes"],
+        processed_bytes=stats["processed_bytes"],
+        ratio=round(ratio, 1),
+        original_seconds=stats["original_seconds"],
+        processed_seconds=stats["processed_seconds"]
+    )
+
+
+def get_stats() -> dict:
+    """
+    取得轉錄快取命中與前處理節省量的統計
+    """
+    saved = TRANSCRIBE_STATS["preprocess_original_bytes"] - TRANSCRIBE_STATS["preprocess_processed_bytes"]
+    return {
+        **TRANSCRIBE_STATS,
+        "preprocess_bytes_saved": saved,
+        "memory_cache_size": len(_memory_cache),
+    }
+
+
+def transcript_cache_key(content: bytes, language: str) -> str:
+    """
+    以音檔內容的 SHA-256、語言與模型組成轉錄快取的 key
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    return f"{digest}:{LANGUAGE_MAPPING.get(language, language)}:{TRANSCRIBE_MODEL}"
+
+
+def _memory_cache_get(cache_key: str) -> str | None:
+    entry = _memory_cache.get(cache_key)
+    if entry is None:
+        return None
+    expires_at, text = entry
+    if expires_at < time.monotonic():
+        del _memory_cache[cache_key]
+        return None
+    _memory_cache.move_to_end(cache_key)
+    return text
+
+
+def _memory_cache_put(cache_key: str, text: str):
+    _memory_cache[cache_key] = (time.monotonic() + TRANSCRIPT_MEMORY_CACHE_TTL_SECONDS, text)
+    _memory_cache.move_to_end(cache_key)
+    while len(_memory_cache) > TRANSCRIPT_MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+async def transcribe_audio_bytes(openai_client, content: bytes, filename: str, language: str, client=None) -> str:
+    """
+    轉錄音檔，結果依音檔內容快取；相同的音檔再次上傳會直接回傳快取結果。
+
+    參數:
+    - openai_client: LLM 客戶端
+    - content: 音檔內容
+    - filename: 檔名（用於判斷格式）
+    - language: 語言代碼
+    - client: MongoDB 客戶端連接（可選，提供時使用 MongoDB 快取）
+
+    返回:
+    - 轉錄文字
+    """
+    cache_key = transcript_cache_key(content, language)
+
+    cached = _memory_cache_get(cache_key)
+    if cached is not None:
+        TRANSCRIBE_STATS["memory_cache_hits"] += 1
+        logger.info("使用記憶體快取的轉錄結果")
+        return cached
+
+    if client is not None:
+        cached = await db.get_cached_transcript(client, cache_key)
+        if cached is not None:
+            TRANSCRIBE_STATS["mongo_cache_hits"] += 1
+            logger.info("使用 MongoDB 快取的轉錄結果")
+            _memory_cache_put(cache_key, cached)
+            return cached
+
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_transcribe_and_cache(openai_client, content, filename, language, client, cache_key))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+
+    # shield 讓其中一個請求中斷時，不會取消其他請求共用的轉錄
+    return await asyncio.shield(task)
+
+
+async def _transcribe_and_cache(openai_client, content: bytes, filename: str, language: str, client, cache_key: str) -> str:
+    TRANSCRIBE_STATS["transcriptions"] += 1
+    text = await transcribe_uncached(openai_client, content, filename, language)
+
+    _memory_cache_put(cache_key, text)
+    if client is not None:
+        await db.save_cached_transcript(client, cache_key, text, len(content))
+
+    return text
+
+
+async def transcribe_uncached(openai_client, content: bytes, filename: str, language: str) -> str:
+    """
+    轉錄音檔（不使用快取）。WAV 會先經過前處理縮小檔案；
+    處理後長度超過 TRANSCRIBE_SPLIT_SECONDS 或大小超過提供者上限的 WAV 會在靜音處切段併發轉錄。
+    """
+    import audio
+    # wave 模組無法解碼的 WAV（例如 IEEE float）直接交給轉錄服務，與非 WAV 格式相同
+    decodable = audio.is_wav(content)
+
+    if decodable and TRANSCRIBE_PREPROCESS:
+        try:
+            content, stats = await asyncio.to_thread(audio.preprocess_for_transcription, content)
+        except audio.AudioDecodeError as e:
+            logger.warning("無法解碼 WAV，略過前處理", error=e)
+            decodable = False
+        else:
+            record_preprocess_stats(stats)
+            filename = f"{os.path.splitext(filename)[0]}.wav"
+            if stats["processed_seconds"] == 0:
+                # 整段都是靜音，不需要呼叫轉錄服務
+                return ""
+
+    if decodable:
+        try:
+            samples, sample_rate = await asyncio.to_thread(audio.decode_wav, content)
+        except audio.AudioDecodeError as e:
+            logger.warning("無法解碼 WAV，改為單次轉錄", error=e)
+        else:
+            duration = len(samples) / sample_rate
+            if duration > TRANSCRIBE_SPLIT_SECONDS or len(content) > PROVIDER_MAX_BYTES:
+                return await transcribe_segmented(openai_client, samples, sample_rate, filename, language)
+
+    if len(content) > PROVIDER_MAX_BYTES:
+        raise AudioTooLargeError("無法在伺服器端切割的音檔大小不能超過 25MB")
+
+    return await transcribe_single(openai_client, content, filename, language)
+
+
+async def transcribe_stored_audio(openai_client, client, user_id: str, note_id: str, file_id: str, language: str = "zh-TW") -> dict:
+    """
+    直接從 GridFS 讀取已儲存的音訊並轉錄，結果寫回對應的筆記行
+
+    參數:
+    - openai_client: LLM 客戶端
+    - client: MongoDB 客戶端連接
+    - user_id: 使用者 ID
+    - note_id: 筆記 ID
+    - file_id: GridFS 檔案 ID
+    - language: 語言代碼
+
+    返回:
+    - {"file_id", "line_id", "text"}，找不到對應的行時 line_id 為 None
+    """
+    import audio
+    content, info = await db.get_gridfs_file(client, user_id, note_id, file_id)
+    if audio.is_compact(content):
+        content = await asyncio.to_thread(audio.decode_compact, content)
+    text = await transcribe_audio_bytes(openai_client, content, info["filename"] or "audio.wav", language, client)
+
+    lines = await db.get_audio_lines(client, user_id, note_id, file_id)
+    line_id = lines[0]["line_id"] if lines else None
+    if line_id is not None:
+        await db.save_line_transcript(client, user_id, note_id, line_id, file_id, text)
+
+    return {"file_id": file_id, "line_id": line_id, "text": text}
+
+
+async def transcribe_note_audio(openai_client, client, user_id: str, note_id: str, language: str = "zh-TW") -> dict:
+    """
+    轉錄筆記中所有尚未轉錄（或音訊已更換）的音訊行
+
+    返回:
+    - {"transcribed": 轉錄的行數}
+    """
+    lines = await db.get_audio_lines(client, user_id, note_id)
+    pending = [line for line in lines if line.get("transcript_file_id") != line["audio_file_id"]]
+
+    for line in pending:
+        await transcribe_stored_audio(openai_client, client, user_id, note_id, line["audio_file_id"], language)
+
+    return {"transcribed": len(pending)}